@@ -9,6 +9,7 @@ Exposición de herramientas MCP para integración con agentes AI (Claude, Copilo
   - get_items(limit: int): Lista artículos
   - get_sales_orders(limit: int): Lista órdenes de venta
   - create_customer(...): Crea un nuevo cliente
+  - create_customers(customers): Alta masiva de clientes en lotes `$batch`
 
 Este servidor:
   - Lee configuración desde `.env` (según buenas prácticas de seguridad)
@@ -47,7 +48,9 @@ if project_root not in sys.path:
 
 from mcp.server.fastmcp import FastMCP
 from config import config
-from client import bc_client
+from client import OutcomeUnknownError, bc_client
+from models import to_dicts
+from odata import ODataQuery
 
 
 # Inicializar servidor MCP para Business Central
@@ -158,60 +161,120 @@ mcp = FastMCP("BusinessCentral")
 
 
 @mcp.tool()
-async def get_customers(limit: int = 10):
+async def get_customers(
+    limit: int = 10,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None
+):
     """
     Lista clientes de Business Central.
     Parámetros:
         limit (int): Número máximo de clientes a retornar (por defecto 10).
+        fields (str): Campos a devolver separados por comas, ej: "number,displayName" (opcional)
+        filter (str): Filtro OData, ej: "city eq 'Madrid'" (opcional)
+        order (str): Ordenación OData, ej: "displayName desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
     Retorna:
         Lista de clientes o error de configuración.
     """
     if not config.validate():
         return {"error": "configuración inválida"}
-    return await bc_client.get_customers(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    try:
+        client = await bc_client.select(profile, company)
+    except ValueError as e:
+        return {"error": str(e)}
+    return to_dicts(await client.get_customers(top=limit, query=query))
 
 
 @mcp.tool()
-async def get_customer_details(customer_id: str):
+async def get_customer_details(customer_id: str, fields: Optional[str] = None, company: Optional[str] = None,
+                               profile: Optional[str] = None):
     """
     Muestra detalles de un cliente por ID.
     Parámetros:
         customer_id (str): ID único del cliente en Business Central.
+        fields (str): Campos a devolver separados por comas (opcional).
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
     Retorna:
         Detalles del cliente o error si no se encuentra.
     """
     if not config.validate():
         return {"error": "configuración inválida"}
-    result = await bc_client.get_customer(customer_id)
-    return result or {"error": "cliente no encontrado"}
+    query = ODataQuery.from_tool_args(fields)
+    try:
+        client = await bc_client.select(profile, company)
+    except ValueError as e:
+        return {"error": str(e)}
+    result = await client.get_customer(customer_id, query=query)
+    return result.to_dict() if result else {"error": "cliente no encontrado"}
 
 
 @mcp.tool()
-async def get_items(limit: int = 10):
+async def get_items(
+    limit: int = 10,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None
+):
     """
     Lista artículos de Business Central.
     Parámetros:
         limit (int): Número máximo de artículos a retornar (por defecto 10).
+        fields (str): Campos a devolver separados por comas, ej: "number,displayName,unitPrice" (opcional)
+        filter (str): Filtro OData, ej: "unitPrice gt 100" (opcional)
+        order (str): Ordenación OData, ej: "displayName desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
     Retorna:
         Lista de artículos o error de configuración.
     """
     if not config.validate():
         return {"error": "configuración inválida"}
-    return await bc_client.get_items(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    try:
+        client = await bc_client.select(profile, company)
+    except ValueError as e:
+        return {"error": str(e)}
+    return to_dicts(await client.get_items(top=limit, query=query))
 
 
 @mcp.tool()
-async def get_sales_orders(limit: int = 5):
+async def get_sales_orders(
+    limit: int = 5,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None
+):
     """
     Lista órdenes de venta de Business Central.
     Parámetros:
         limit (int): Número máximo de órdenes a retornar (por defecto 5).
+        fields (str): Campos a devolver separados por comas, ej: "number,customerName,totalAmountIncludingTax" (opcional)
+        filter (str): Filtro OData, ej: "status eq 'Open'" (opcional)
+        order (str): Ordenación OData, ej: "orderDate desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
     Retorna:
         Lista de órdenes de venta o error de configuración.
     """
     if not config.validate():
         return {"error": "configuración inválida"}
-    return await bc_client.get_orders(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    try:
+        client = await bc_client.select(profile, company)
+    except ValueError as e:
+        return {"error": str(e)}
+    return to_dicts(await client.get_orders(top=limit, query=query))
 
 
 @mcp.tool(name="create_customer")
@@ -235,7 +298,10 @@ async def create_customer(
     paymentTermsId: Optional[str] = None,
     shipmentMethodId: Optional[str] = None,
     paymentMethodId: Optional[str] = None,
-    blocked: Optional[str] = None
+    blocked: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Crea un nuevo cliente en Business Central.
@@ -245,6 +311,9 @@ async def create_customer(
         type (str): Tipo de cliente (por defecto 'Company')
         addressLine1, addressLine2, city, state, country, postalCode, phoneNumber, website, etc.
         taxRegistrationNumber (str): Recomendado para clientes fiscales
+        idempotency_key (str): Clave única de la operación; repetirla no crea un duplicado
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
     Retorna:
         Resultado de la creación o advertencia/error.
     Notas:
@@ -280,7 +349,68 @@ async def create_customer(
         "paymentMethodId": paymentMethodId,
         "blocked": blocked
     }
-    return await bc_client.create_customer(customer_data)
+    try:
+        client = await bc_client.select(profile, company)
+        return await client.create_customer(customer_data, idempotency_key=idempotency_key)
+    except (ValueError, OutcomeUnknownError) as e:
+        return {"error": str(e)}
+
+
+@mcp.tool(name="create_customers")
+async def create_customers(
+    customers: list[dict],
+    changeset_size: Optional[int] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Crea varios clientes en Business Central en una sola operación (lotes `$batch` en paralelo).
+    Parámetros:
+        customers (list[dict]): Clientes con los campos de la entidad Customer de BC
+            ('displayName' y 'email' obligatorios en cada uno).
+        changeset_size (int): Clientes por lote $batch (1-100, opcional).
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
+    Retorna:
+        Resumen {total, created, failed} y un resultado por cliente (index, ok, customer o error).
+    """
+    if not config.validate():
+        return {"error": "configuración inválida"}
+    if not customers:
+        return {"error": "La lista 'customers' no puede estar vacía"}
+    invalid = [i for i, c in enumerate(customers) if not c.get("displayName") or not c.get("email")]
+    if invalid:
+        return {"error": f"Los campos 'displayName' y 'email' son obligatorios (clientes {invalid})"}
+    if changeset_size is not None and not 1 <= changeset_size <= 100:
+        return {"error": "changeset_size debe estar entre 1 y 100"}
+    payload = [{k: v for k, v in c.items() if v is not None} for c in customers]
+    try:
+        client = await bc_client.select(profile, company)
+    except ValueError as e:
+        return {"error": str(e)}
+    return await client.create_customers(payload, changeset_size=changeset_size)
+
+
+@mcp.tool()
+async def find_customer_all_companies(search: str, limit: int = 5, profile: Optional[str] = None):
+    """
+    Busca un cliente en todas las compañías en paralelo.
+    Parámetros:
+        search (str): Número exacto, email exacto o texto contenido en el nombre.
+        limit (int): Coincidencias máximas por compañía (por defecto 5).
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional).
+    Retorna:
+        Clientes encontrados con 'companyId' y 'companyName', o error de configuración.
+    """
+    if not config.validate():
+        return {"error": "configuración inválida"}
+    if not search:
+        return {"error": "El parámetro 'search' no puede estar vacío"}
+    try:
+        client = bc_client.for_profile(profile)
+    except ValueError as e:
+        return {"error": str(e)}
+    return await client.find_customers_all_companies(search, top=limit)
 
 
 if __name__ == "__main__":
@@ -7,7 +7,16 @@ Gestionar la autenticación OAuth2 con Azure AD (Entra ID) usando el flujo Clien
 incluyendo cache de tokens y helpers asíncronos para obtener y renovar el token de acceso.
 
 Este módulo centraliza la obtención de tokens para acceder a la API de Business Central desde Python,
-siguiendo las mejores prácticas de seguridad y eficiencia.
+siguiendo las mejores prácticas de seguridad y eficiencia:
+  - Una sola petición de token en vuelo (single-flight): las llamadas concurrentes esperan al mismo fetch.
+  - Renovación proactiva en segundo plano `AZURE_TOKEN_REFRESH_MARGIN` segundos antes de expirar.
+  - Cliente HTTP persistente para el endpoint de tokens de Entra ID.
+  - Un gestor por tenant/aplicación (`token_manager_for`): los perfiles de `config.profiles`
+    que comparten credenciales comparten también el token.
+  - Caché opcional en disco (`AZURE_TOKEN_CACHE_ENABLED`) o en el estado compartido entre
+    workers (`BC_SHARED_STATE=sqlite`): un worker nuevo o reiniciado reutiliza el token aún
+    válido que guardó otro proceso en vez de pedir uno a Entra ID, y las renovaciones se
+    escalonan con un retardo aleatorio para que solo un worker vaya a Entra ID.
 
 Referencias:
 - https://learn.microsoft.com/en-us/azure/active-directory/develop/v2-oauth2-client-creds-grant-flow
@@ -19,62 +28,274 @@ Referencias:
 # =============================
 import asyncio
 import httpx
+import logging
+import random
+import time
 from datetime import datetime, timedelta
-from typing import Optional
-from config import config
+from typing import Dict, Optional, Tuple, Union
+from config import AzureADConfig, config
+from shared_state import shared_store
+from token_cache import FileTokenCache, StoreTokenCache, cache_key
+
+logger = logging.getLogger("azure_auth")
+
+# Margen de seguridad: nunca se entrega un token al que le queden menos de estos segundos
+_EXPIRY_SKEW = 60
+
+# Espera tras un refresco en segundo plano fallido: 5, 10, 20... hasta 60 segundos
+_REFRESH_RETRY_BASE = 5.0
+_REFRESH_RETRY_MAX = 60.0
 
 
 # =============================
 # CLASE PRINCIPAL DE GESTIÓN DE TOKENS
 # =============================
 class AzureTokenManager:
-    def __init__(self):
+    def __init__(self, azure: Optional[AzureADConfig] = None,
+                 disk: Optional[Union[FileTokenCache, StoreTokenCache]] = None):
+        # Credenciales de la aplicación (por defecto las de AZURE_*)
+        self._azure = azure or config.azure_ad
+        # Caché de tokens compartida con otros procesos (None si está desactivada)
+        self._disk = disk
         # Token actual y expiración
         self._token: Optional[str] = None
         self._expires: Optional[datetime] = None
         # Scope de acceso para Business Central
         self._scope = "https://api.businesscentral.dynamics.com/.default"
+        self._cache_key = cache_key(self._azure.tenant_id, self._azure.client_id, self._scope)
+        # Coordinación de renovaciones: un único fetch en vuelo y una tarea de refresco programada
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_due: float = 0.0
+        # Refrescos en segundo plano fallidos seguidos (espera exponencial antes del siguiente)
+        self._refresh_failures = 0
+        # Borrado en curso de un token rechazado de la caché en disco (se hace en un hilo)
+        self._pending_delete: Optional[asyncio.Task] = None
+        self._refresh_margin = self._azure.token_refresh_margin
+        # Cliente HTTP persistente para el endpoint de tokens
+        self._http: Optional[httpx.AsyncClient] = None
 
 
     # =============================
     # MÉTODO PRIVADO: ¿Token válido?
     # =============================
     def _valid(self) -> bool:
-        return self._token and self._expires and datetime.utcnow() < self._expires
+        return bool(
+            self._token and self._expires
+            and datetime.utcnow() < self._expires - timedelta(seconds=_EXPIRY_SKEW)
+        )
+
+
+    # =============================
+    # MÉTODO PRIVADO: ¿Toca renovar en segundo plano?
+    # =============================
+    def _needs_refresh(self) -> bool:
+        if not self._expires:
+            return True
+        return datetime.utcnow() >= self._expires - timedelta(seconds=self._refresh_margin)
 
 
     # =============================
     # OBTENER TOKEN (público, preferido)
     # =============================
-    async def get_token(self) -> Optional[str]:
+    async def get_token(self, timeout: Optional[float] = None) -> Optional[str]:
         """
         Devuelve un token válido, renovando si es necesario.
+        `timeout` acota la petición a Azure AD (p.ej. al plazo restante de la llamada).
+        Si el token está dentro del margen de renovación se devuelve igualmente y se
+        lanza un refresco en segundo plano. Las llamadas concurrentes sin token válido
+        comparten un único fetch contra Azure AD.
         """
         if self._valid():
+            # Tras un refresco fallido ya hay otro programado con espera: no se adelanta
+            if self._needs_refresh() and not self._refresh_failures:
+                self._schedule_refresh(0)
             return self._token
-        return await self._fetch()
+        async with self._lock:
+            # Otra corrutina pudo renovar el token mientras esperábamos el lock
+            if self._valid():
+                return self._token
+            # Arranque en frío: token aún válido guardado por este u otro proceso
+            if await self._load_cached():
+                if self._needs_refresh():
+                    self._schedule_refresh(0)
+                return self._token
+            return await self._fetch(timeout)
+
+
+    # =============================
+    # INVALIDAR TOKEN (tras un 401)
+    # =============================
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """
+        Descarta el token cacheado. Si se indica `token`, solo se descarta cuando coincide
+        con el actual, para no perder un token que otra corrutina ya ha renovado.
+        """
+        if token is None or token == self._token:
+            if self._disk is not None:
+                self._forget_cached(token or self._token)
+            self._token = None
+            self._expires = None
+
+
+    # =============================
+    # CICLO DE VIDA DEL CLIENTE HTTP
+    # =============================
+    async def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(timeout=30)
+        return self._http
+
+    async def aclose(self) -> None:
+        """
+        Cancela el refresco programado y cierra el cliente HTTP del endpoint de tokens.
+        """
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
+        if self._pending_delete is not None:
+            await self._pending_delete
+            self._pending_delete = None
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+
+
+    # =============================
+    # MÉTODOS PRIVADOS: Renovación proactiva
+    # =============================
+    def _schedule_refresh(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        due = loop.time() + delay
+        task = self._refresh_task
+        if task and not task.done() and task is not asyncio.current_task():
+            if delay == 0 and self._refresh_due <= due:
+                # Ya hay un refresco en curso o a punto de lanzarse
+                return
+            task.cancel()
+        self._refresh_due = due
+        self._refresh_task = loop.create_task(self._refresh_after(delay))
+
+    async def _refresh_after(self, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+            async with self._lock:
+                if self._valid() and not self._needs_refresh():
+                    return
+                # Otro worker pudo haber renovado ya el token
+                if await self._load_cached() and not self._needs_refresh():
+                    return
+                if await self._fetch() is not None:
+                    return
+            reason = "Azure AD no devolvió token"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = repr(e)
+        # Reintento con espera exponencial en lugar de uno inmediato por cada get_token()
+        self._refresh_failures += 1
+        retry = min(_REFRESH_RETRY_MAX, _REFRESH_RETRY_BASE * 2 ** (self._refresh_failures - 1))
+        logger.warning(f"Fallo al renovar el token en segundo plano ({reason}); nuevo intento en {retry:.0f}s.")
+        self._schedule_refresh(retry)
+
+
+    # =============================
+    # MÉTODOS PRIVADOS: Caché en disco
+    # =============================
+    async def _load_cached(self) -> bool:
+        """
+        Adopta el token de la caché en disco si caduca más tarde que el actual y programa
+        su renovación. Retorna True si queda un token válido.
+        """
+        if self._disk is None:
+            return False
+        if self._pending_delete is not None:
+            await self._pending_delete
+            self._pending_delete = None
+        try:
+            entry = await asyncio.to_thread(self._disk.get, self._cache_key)
+        except OSError as e:
+            logger.warning(f"No se pudo leer la caché de tokens en disco: {e!r}")
+            return False
+        if entry is None:
+            return False
+        token, expires_at = entry
+        expires = datetime.utcnow() + timedelta(seconds=expires_at - time.time())
+        if self._expires is not None and expires <= self._expires:
+            return self._valid()
+        self._token, self._expires = token, expires
+        if self._valid() and not self._needs_refresh():
+            remaining = (expires - datetime.utcnow()).total_seconds()
+            self._schedule_refresh(remaining - self._refresh_margin + self._refresh_jitter())
+        return self._valid()
+
+    def _refresh_jitter(self) -> float:
+        """
+        Retardo aleatorio de la renovación cuando el token se comparte con otros procesos:
+        el primero en despertar lo renueva y los demás lo leen de la caché.
+        """
+        if self._disk is None:
+            return 0.0
+        return random.uniform(0, min(60.0, self._refresh_margin / 5))
+
+    def _forget_cached(self, token: Optional[str]) -> None:
+        """
+        Borra `token` de la caché en disco en un hilo, sin bloquear el event loop; la siguiente
+        lectura de la caché espera a que termine para no recuperar el token rechazado.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._delete_cached(token)
+            return
+        self._pending_delete = loop.create_task(asyncio.to_thread(self._delete_cached, token))
+
+    def _delete_cached(self, token: Optional[str]) -> None:
+        try:
+            self._disk.delete(self._cache_key, token)
+        except OSError as e:
+            logger.warning(f"No se pudo actualizar la caché de tokens en disco: {e!r}")
+
+    async def _store_cached(self, token: str, expires_in: float) -> None:
+        if self._disk is None:
+            return
+        try:
+            await asyncio.to_thread(self._disk.put, self._cache_key, token, time.time() + expires_in)
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la caché de tokens en disco: {e!r}")
 
 
     # =============================
     # MÉTODO PRIVADO: Solicitar nuevo token a Azure AD
     # =============================
-    async def _fetch(self) -> Optional[str]:
-        url = f"{config.azure_ad.authority}/oauth2/v2.0/token"
+    async def _fetch(self, timeout: Optional[float] = None) -> Optional[str]:
+        url = f"{self._azure.authority}/oauth2/v2.0/token"
         data = {
             "grant_type": "client_credentials",
-            "client_id": config.azure_ad.client_id,
-            "client_secret": config.azure_ad.client_secret,
+            "client_id": self._azure.client_id,
+            "client_secret": self._azure.client_secret,
             "scope": self._scope
         }
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        async with httpx.AsyncClient() as cli:
-            resp = await cli.post(url, data=data, headers=headers, timeout=30)
+        cli = await self._get_http()
+        try:
+            resp = await cli.post(url, data=data, headers=headers, timeout=timeout if timeout is not None else 30)
+        except httpx.TransportError as e:
+            # Plazo agotado o Entra ID inaccesible: mismo tratamiento que una respuesta de error
+            logger.error(f"Token Azure AD: error de red ({e!r})")
+            return None
         if resp.status_code == 200:
             j = resp.json()
+            expires_in = j.get("expires_in", 3600)
             self._token = j["access_token"]
-            self._expires = datetime.utcnow() + timedelta(seconds=j.get("expires_in", 3600))
+            self._expires = datetime.utcnow() + timedelta(seconds=expires_in)
+            self._refresh_failures = 0
+            # Programar la renovación antes de la expiración (nunca antes de la mitad de la vida útil)
+            margin = min(self._refresh_margin, expires_in / 2)
+            self._schedule_refresh(expires_in - margin + min(self._refresh_jitter(), margin / 2))
+            await self._store_cached(self._token, expires_in)
             return self._token
-        print(f"[ERROR] Token Azure AD: {resp.status_code}")
+        logger.error(f"Token Azure AD: {resp.status_code}")
         return None
 
 
@@ -85,12 +306,12 @@ class AzureTokenManager:
         """
         Adquiere un nuevo token de Azure AD usando un body URL-encoded (útil para debugging avanzado).
         """
-        token_url = f"{config.azure_ad.authority}/oauth2/v2.0/token"
+        token_url = f"{self._azure.authority}/oauth2/v2.0/token"
         # Construimos el body como URL-encoded
         form = {
             "grant_type":    "client_credentials",
-            "client_id":     config.azure_ad.client_id,
-            "client_secret": config.azure_ad.client_secret,
+            "client_id":     self._azure.client_id,
+            "client_secret": self._azure.client_secret,
             "scope":         self._scope
         }
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
@@ -123,4 +344,36 @@ class AzureTokenManager:
 # =============================
 # SINGLETON GLOBAL PARA USO EN TODO EL PROYECTO
 # =============================
-token_manager = AzureTokenManager()
\ No newline at end of file
+# Caché de tokens compartida por todos los gestores: el estado compartido entre workers si
+# está activo, si no el fichero de AZURE_TOKEN_CACHE_PATH (None si ambos están desactivados)
+_token_cache: Optional[Union[FileTokenCache, StoreTokenCache]] = (
+    StoreTokenCache(shared_store) if shared_store.cross_process
+    else FileTokenCache(config.token_cache.path) if config.token_cache.enabled else None
+)
+
+token_manager = AzureTokenManager(disk=_token_cache)
+
+# Gestores por (authority, client_id): uno por aplicación de Azure AD y tenant
+_managers: Dict[Tuple[str, str], AzureTokenManager] = {
+    (config.azure_ad.authority, config.azure_ad.client_id): token_manager
+}
+
+
+def token_manager_for(azure: AzureADConfig) -> AzureTokenManager:
+    """
+    Devuelve el gestor de tokens de unas credenciales, creándolo la primera vez.
+    Para las credenciales por defecto devuelve `token_manager`.
+    """
+    key = (azure.authority, azure.client_id)
+    manager = _managers.get(key)
+    if manager is None:
+        manager = _managers[key] = AzureTokenManager(azure, _token_cache)
+    return manager
+
+
+async def aclose_token_managers() -> None:
+    """
+    Cierra todos los gestores de tokens (llamar al apagar el servidor).
+    """
+    for manager in list(_managers.values()):
+        await manager.aclose()
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+bench_json.py
+
+Benchmark del códec JSON: compara `json` (librería estándar) con `orjson` sobre páginas
+de clientes y órdenes de venta con la forma real de la API v2.0 de Business Central.
+
+Mide las dos operaciones que hace el servidor en cada llamada:
+  - decode: cuerpo de la respuesta de BC -> dict (lo que hace `BusinessCentralClient`)
+  - encode: resultado de la herramienta -> texto JSON indentado (respuesta MCP)
+
+Uso:
+    python bench_json.py                # 100 y 1000 registros por página
+    python bench_json.py --records 5000 --repeat 20
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _guid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+def make_customer(i: int, rng: random.Random) -> Dict[str, Any]:
+    """
+    Cliente con los campos de la entidad `customers` de la API v2.0.
+    """
+    city = rng.choice(["Madrid", "Barcelona", "Sevilla", "Valencia", "Bilbao", "Zaragoza"])
+    return {
+        "@odata.etag": f"W/\"JzIwOzE{rng.randrange(10**15)}MTswMDsn\"",
+        "id": _guid(rng),
+        "number": f"C{i:05d}",
+        "displayName": f"Cliente Ñandú {i} S.L.",
+        "type": "Company",
+        "addressLine1": f"Calle Mayor {rng.randrange(1, 300)}",
+        "addressLine2": "",
+        "city": city,
+        "state": "",
+        "country": "ES",
+        "postalCode": f"{rng.randrange(1000, 52999):05d}",
+        "phoneNumber": f"+34 9{rng.randrange(10**7, 10**8)}",
+        "email": f"contacto{i}@cliente{i}.es",
+        "website": f"www.cliente{i}.es",
+        "salespersonCode": rng.choice(["JR", "PS", "BC", ""]),
+        "balanceDue": round(rng.uniform(0, 250000), 2),
+        "creditLimit": rng.choice([0, 10000, 50000]),
+        "taxLiable": rng.random() < 0.8,
+        "taxAreaId": _guid(rng),
+        "taxAreaDisplayName": "NACIONAL",
+        "taxRegistrationNumber": f"B{rng.randrange(10**7, 10**8)}",
+        "currencyId": "00000000-0000-0000-0000-000000000000",
+        "currencyCode": "EUR",
+        "paymentTermsId": _guid(rng),
+        "shipmentMethodId": _guid(rng),
+        "paymentMethodId": _guid(rng),
+        "blocked": rng.choice(["_x0020_", "Ship", "Invoice"]),
+        "lastModifiedDateTime": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T10:{rng.randrange(60):02d}:00.123Z",
+    }
+
+
+def make_order(i: int, rng: random.Random) -> Dict[str, Any]:
+    """
+    Orden de venta con los campos de la entidad `salesOrders` de la API v2.0.
+    """
+    net = round(rng.uniform(50, 90000), 2)
+    tax = round(net * 0.21, 2)
+    address = {
+        "Address": f"Avenida {rng.randrange(1, 200)}", "Address2": "", "City": "Madrid",
+        "State": "", "CountryLetterCode": "ES", "PostalCode": "28001",
+    }
+    order = {
+        "@odata.etag": f"W/\"JzE5OzE{rng.randrange(10**15)}MTswMDsn\"",
+        "id": _guid(rng),
+        "number": f"S-ORD{101000 + i}",
+        "externalDocumentNumber": "",
+        "orderDate": "2024-05-17",
+        "postingDate": "2024-05-17",
+        "customerId": _guid(rng),
+        "customerNumber": f"C{rng.randrange(1, 5000):05d}",
+        "customerName": f"Cliente Ñandú {i} S.L.",
+        "billToName": f"Cliente Ñandú {i} S.L.",
+        "billToCustomerId": _guid(rng),
+        "billToCustomerNumber": f"C{rng.randrange(1, 5000):05d}",
+        "shipToName": f"Cliente Ñandú {i} S.L.",
+        "shipToContact": "Ana García",
+        "currencyId": "00000000-0000-0000-0000-000000000000",
+        "currencyCode": "EUR",
+        "pricesIncludeTax": False,
+        "paymentTermsId": _guid(rng),
+        "shipmentMethodId": _guid(rng),
+        "salesperson": "JR",
+        "partialShipping": True,
+        "requestedDeliveryDate": "2024-05-24",
+        "discountAmount": 0,
+        "discountAppliedBeforeTax": True,
+        "totalAmountExcludingTax": net,
+        "totalTaxAmount": tax,
+        "totalAmountIncludingTax": round(net + tax, 2),
+        "fullyShipped": False,
+        "status": rng.choice(["Draft", "Open", "Released"]),
+        "lastModifiedDateTime": "2024-05-17T09:12:44.870Z",
+        "phoneNumber": "",
+        "email": f"compras{i}@cliente{i}.es",
+    }
+    for prefix in ("sellingPostal", "billingPostal", "shippingPostal"):
+        for key, value in address.items():
+            order[f"{prefix}{key}"] = value
+    return order
+
+
+def make_page(factory: Callable[[int, random.Random], Dict], records: int) -> Dict[str, Any]:
+    rng = random.Random(42)
+    return {
+        "@odata.context": "https://api.businesscentral.dynamics.com/v2.0/$metadata#companies(...)",
+        "value": [factory(i, rng) for i in range(records)],
+    }
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+    """
+    Mejor tiempo (ms) de `repeat` ejecuciones.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(records: int, repeat: int) -> None:
+    for name, factory in (("customers", make_customer), ("salesOrders", make_order)):
+        page = make_page(factory, records)
+        body = json.dumps(page).encode()
+        result: List[Dict] = page["value"]
+        rows = [
+            ("decode", "json", lambda: json.loads(body)),
+            ("encode", "json", lambda: json.dumps(result, default=str, ensure_ascii=False, indent=2)),
+        ]
+        if orjson is not None:
+            rows.insert(1, ("decode", "orjson", lambda: orjson.loads(body)))
+            rows.append(("encode", "orjson",
+                         lambda: orjson.dumps(result, default=str, option=orjson.OPT_INDENT_2).decode()))
+        print(f"\n{name}: {records} registros, {len(body) / 1024:.0f} KiB")
+        baseline: Dict[str, float] = {}
+        for op, backend, fn in rows:
+            ms = _time(fn, repeat)
+            baseline.setdefault(op, ms)
+            print(f"  {op:<7} {backend:<7} {ms:9.2f} ms   x{baseline[op] / ms:5.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark json vs orjson con payloads de Business Central")
+    parser.add_argument("--records", type=int, nargs="*", default=[100, 1000], help="Registros por página")
+    parser.add_argument("--repeat", type=int, default=10, help="Repeticiones por medida (se toma la mejor)")
+    args = parser.parse_args()
+    if orjson is None:
+        print("orjson no está instalado: solo se mide la librería estándar (pip install orjson)")
+    for records in args.records:
+        run(records, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+cache.py
+
+Caché de respuestas en memoria para el cliente de Business Central.
+
+Características principales:
+  - Expulsión LRU acotada por número de entradas.
+  - TTL por entidad (p.ej. largo para `items`, corto para `salesOrders`).
+  - Invalidación por entidad tras escrituras (`create_customer`, ...).
+  - Las entradas expiradas se conservan (hasta que el LRU las expulse) para poder
+    revalidarlas con `If-None-Match` si llevan `@odata.etag`.
+  - Contadores de aciertos, fallos, revalidaciones, expulsiones e invalidaciones.
+  - Segundo nivel opcional en el almacén compartido entre workers (`BC_SHARED_STATE=sqlite`):
+    lo que cachea un worker lo reutilizan los demás, y una invalidación en cualquiera de ellos
+    (contador de generación por entidad) deja obsoletas las copias en memoria de todos.
+    La generación se consulta como mucho una vez cada `BC_CACHE_GENERATION_TTL` s por entidad
+    y todo acceso al fichero se hace en un hilo, fuera del event loop; un acierto en memoria
+    no lo toca.
+
+Onboarding rápido:
+  1. Activa la caché con `BC_CACHE_ENABLED=true` en el `.env`.
+  2. Ajusta los TTL con `BC_CACHE_TTLS="items=600,customers=120,salesOrders=15"`.
+  3. Consulta `bc_client.cache.stats()` para ver la eficacia de la caché.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import jsoncodec
+from shared_state import MemoryStore, SharedStore
+
+logger = logging.getLogger("cache")
+
+class ResponseCache:
+    """
+    Caché LRU con TTL por entidad. No es segura entre hilos, pero sí dentro de un
+    único event loop de asyncio: `get` e `invalidate` solo esperan al almacén compartido y
+    releen el estado en memoria tras cada espera.
+    """
+    def __init__(self, max_entries: int = 1000, default_ttl: float = 60.0,
+                 ttls: Optional[Dict[str, float]] = None,
+                 shared: Optional[SharedStore] = None, scope: str = "",
+                 decode: Optional[Callable[[str, Any], Any]] = None,
+                 generation_ttl: float = 1.0):
+        self._max_entries = max_entries
+        self._default_ttl = default_ttl
+        self._ttls = dict(ttls or {})
+        # Almacén de los contadores de generación y, si lo comparten varios procesos, segundo
+        # nivel de la caché. `scope` separa las claves de cada compañía/entorno y
+        # `decode(entidad, json)` reconstruye los valores leídos del segundo nivel
+        self._shared = shared if shared is not None else MemoryStore()
+        self._scope = scope
+        self._decode = decode
+        # entidad -> (generación, instante monotónico de la consulta); las invalidaciones de otros
+        # procesos se ven como mucho `generation_ttl` s después, las de este al instante
+        self._generation_ttl = generation_ttl
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        # clave -> (entidad, expiración monotónica, valor, generación de la entidad)
+        self._entries: "OrderedDict[Hashable, Tuple[str, float, Any, int]]" = OrderedDict()
+        self.shared_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def ttl_for(self, entity: str) -> float:
+        """
+        Devuelve el TTL (segundos) configurado para una entidad.
+        """
+        return self._ttls.get(entity, self._default_ttl)
+
+    async def _offload(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Ejecuta una operación del almacén: en un hilo si es compartido entre procesos (accede
+        al fichero) y directamente si es el del propio proceso.
+        """
+        if self._shared.cross_process:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def _generation(self, entity: str) -> int:
+        """
+        Generación actual de una entidad en el almacén.
+        """
+        cached = self._generations.get(entity)
+        if cached is not None and time.monotonic() - cached[1] < self._generation_ttl:
+            return cached[0]
+        generation = await self._offload(self._shared.counter, f"gen|{self._scope}|{entity}")
+        # Una invalidación durante la consulta pudo dejar ya una generación más reciente
+        current = self._generations.get(entity)
+        if current is not None and current[0] > generation:
+            return current[0]
+        self._generations[entity] = (generation, time.monotonic())
+        return generation
+
+    def _known_generation(self, entity: str) -> int:
+        """
+        Última generación conocida de una entidad, sin consultar el almacén. Si ya no es la
+        actual, la entrada guardada con ella simplemente no se usará.
+        """
+        cached = self._generations.get(entity)
+        return cached[0] if cached is not None else 0
+
+    def _shared_key(self, key: Hashable, entity: str, generation: int) -> str:
+        return f"resp|{self._scope}|{entity}|{generation}|{key!r}"
+
+    async def get(self, key: Hashable, entity: Optional[str] = None) -> Optional[Any]:
+        """
+        Devuelve el valor cacheado o None si no existe o ha expirado.
+        Las entradas expiradas no se borran: siguen disponibles vía `peek()` para revalidar.
+        Con almacén compartido entre procesos, `entity` permite buscar en él lo que no esté
+        en memoria.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            entity = entry[0]
+        generation = await self._generation(entity) if entity else 0
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry[1] and entry[3] == generation:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        if self._shared.cross_process and entity:
+            found = await self._offload(self._shared.get, self._shared_key(key, entity, generation))
+            if found is not None:
+                raw, expires_at = found
+                value = jsoncodec.loads(raw)
+                if self._decode is not None:
+                    value = self._decode(entity, value)
+                self._store(key, entity, time.monotonic() + (expires_at - time.time()), value, generation)
+                self.hits += 1
+                self.shared_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """
+        Devuelve el valor almacenado aunque haya expirado, sin alterar contadores ni orden LRU.
+        """
+        entry = self._entries.get(key)
+        return entry[2] if entry else None
+
+    def revalidated(self, key: Hashable, entity: str, value: Any) -> None:
+        """
+        Renueva el TTL de una entrada confirmada por el servidor (respuesta 304).
+        """
+        self.revalidations += 1
+        self.set(key, entity, value)
+
+    def set(self, key: Hashable, entity: str, value: Any) -> None:
+        """
+        Guarda un valor con el TTL de su entidad, expulsando las entradas menos usadas.
+        """
+        ttl = self.ttl_for(entity)
+        if ttl <= 0:
+            return
+        generation = self._known_generation(entity)
+        self._store(key, entity, time.monotonic() + ttl, value, generation)
+        if self._shared.cross_process:
+            args = (self._shared_key(key, entity, generation), jsoncodec.dumps(value), time.time() + ttl)
+            try:
+                # Dentro del event loop la escritura va a un hilo: no retrasa la respuesta
+                future = asyncio.get_running_loop().run_in_executor(None, self._shared.set, *args)
+            except RuntimeError:
+                self._shared.set(*args)
+            else:
+                future.add_done_callback(self._shared_set_done)
+
+    @staticmethod
+    def _shared_set_done(future: "asyncio.Future[None]") -> None:
+        """
+        Recoge el resultado de una escritura en segundo plano en el almacén compartido.
+        """
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Caché compartida: no se pudo guardar la respuesta ({future.exception()!r})")
+
+    def _store(self, key: Hashable, entity: str, expires: float, value: Any, generation: int) -> None:
+        self._entries[key] = (entity, expires, value, generation)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def invalidate(self, entity: Optional[str] = None) -> int:
+        """
+        Elimina las entradas de una entidad (o todas si no se indica).
+        Con almacén compartido entre procesos, invalida también las copias de los demás.
+        Retorna el número de entradas eliminadas.
+        """
+        entities = [entity] if entity is not None else list({e for e, _, _, _ in self._entries.values()} | set(self._ttls))
+        for name in entities:
+            # Mientras se incrementa, lo que se cachee queda con generación 0 (obsoleta) y las
+            # lecturas de este proceso vuelven a consultar el contador
+            self._generations.pop(name, None)
+        removed = self._drop(entity)
+        generations = await asyncio.gather(
+            *(self._offload(self._shared.incr, f"gen|{self._scope}|{name}") for name in entities)
+        )
+        for name, generation in zip(entities, generations):
+            if generation:
+                self._generations[name] = (generation, time.monotonic())
+            else:
+                self._generations.pop(name, None)
+        return removed
+
+    def _drop(self, entity: Optional[str]) -> int:
+        """
+        Elimina de memoria las entradas de una entidad (o todas) y retorna cuántas eran.
+        """
+        if entity is None:
+            removed = len(self._entries)
+            self._entries.clear()
+        else:
+            keys = [k for k, (e, _, _, _) in self._entries.items() if e == entity]
+            for k in keys:
+                del self._entries[k]
+            removed = len(keys)
+        self.invalidations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve los contadores de la caché.
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -5,13 +5,53 @@ Cliente HTTP asíncrono y resiliente para la API de Microsoft Dynamics 365 Busin
 
 Características principales:
   - Obtiene y refresca tokens Azure AD automáticamente (OAuth2/Entra ID).
-  - Implementa lógica de reintentos exponenciales y manejo robusto de errores HTTP (401, 5xx).
+  - Política de reintentos enchufable (`RetryPolicy`): backoff exponencial con jitter completo,
+    POST/PATCH solo se repiten si BC no llegó a procesarlos (401, 429, fallo de conexión) y un
+    presupuesto global (`BC_RETRY_BUDGET_RATIO`) evita multiplicar la carga durante una caída.
+  - Escrituras idempotentes: `create_customer` acepta una clave de idempotencia y, tras un
+    fallo incierto, comprueba si el cliente ya existe antes de reenviar el POST.
+  - Respeta `Retry-After` ante 429 y limita la tasa con un token bucket compartido por
+    tenant/entorno (`BC_RATE_LIMIT_RPS`, `BC_RATE_LIMIT_BURST`).
+  - Circuit breaker por entidad: mientras BC falla se responde al instante sin reintentar
+    y se sondea la recuperación tras `BC_CB_RECOVERY_TIMEOUT` segundos.
+  - Limitador adaptativo de concurrencia (AIMD) opcional (`BC_CONCURRENCY_ADAPTIVE`): ajusta
+    las peticiones en vuelo a la capacidad real de BC comparando la latencia de cada tipo de
+    petición con su propia base; el exceso espera en cola como mucho `BC_CONCURRENCY_MAX_WAIT` s.
+  - Hedging opcional de lecturas (`BC_HEDGE_ENABLED`): si un GET tarda más que el percentil
+    configurado se lanza otro idéntico y se usa el primero que responda.
+  - Plazo extremo a extremo por llamada (`BC_REQUEST_DEADLINE` o `deadline_scope()` desde la
+    herramienta MCP): acota token, intentos y esperas, y no reintenta si ya no hay tiempo.
+  - Decodifica y codifica JSON con `jsoncodec` (orjson si está instalado, si no `json`).
+  - Reutiliza un único `httpx.AsyncClient` por proceso (pool de conexiones con keep-alive
+    y HTTP/2 opcional) para evitar un handshake TCP+TLS en cada llamada.
+  - Multicompañía: `for_company()` resuelve una compañía (id, nombre) contra la lista cacheada
+    de `companies` y devuelve su cliente, que comparte pool y limitadores con el raíz;
+    `fan_out()` / `find_customers_all_companies()` consultan todas las compañías en paralelo.
+  - Multitenant/multientorno: `for_profile()` devuelve el cliente de un perfil de
+    `config.profiles` (`BC_PROFILES`), con su propio token, pool, limitadores y cachés;
+    `select(profile, company)` combina perfil y compañía para las herramientas MCP.
   - Expone métodos asíncronos para operaciones clave:
       * get_customers(top): Lista clientes
       * get_customer(id): Detalle de cliente
       * get_items(top): Lista artículos
       * get_orders(top): Lista órdenes de venta
       * create_customer(data): Crea un nuevo cliente
+      * create_customers(list): Alta masiva en lotes `$batch` paralelos con resultado por registro
+      * iter_customers()/iter_items()/iter_orders(): Recorren colecciones completas
+        siguiendo `@odata.nextLink` (paginación del servidor) registro a registro,
+        decodificando cada página en streaming (memoria acotada a un registro)
+      * bulk_fetch(entity): Extracción completa en paralelo por ventanas `$skip`/`$top`
+  - Coalesce GET idénticos concurrentes (single-flight): comparten una única petición en vuelo.
+  - Agrupa GET concurrentes en una sola petición OData `$batch` (ventana configurable con
+    `BC_BATCH_WINDOW_MS` o explícitamente con `async with bc_client.batch(): ...`).
+  - Caché de lecturas opcional con TTL por entidad y LRU (`BC_CACHE_ENABLED`), invalidada
+    por las escrituras y con posibilidad de omitirla por llamada (`use_cache=False`).
+    Las entidades cacheadas con `@odata.etag` se revalidan con `If-None-Match` (304).
+    Con `BC_SHARED_STATE=sqlite` la caché y el token se comparten entre los workers de la máquina.
+  - Las lecturas de clientes, artículos y órdenes devuelven registros compactos con
+    `__slots__` (`models.Customer`, `Item`, `SalesOrder`); se convierten a dict con `to_dict()`.
+  - Todos los métodos de lectura aceptan un `ODataQuery` opcional ($select, $filter,
+    $orderby, $expand) para que Business Central filtre y proyecte en servidor.
 
 Onboarding rápido:
   1. Asegúrate de que el archivo `.env` esté correctamente configurado (ver README).
@@ -27,9 +67,25 @@ import asyncio
 import httpx
 import logging
 import os
-from typing import Any, Dict, List, Optional
-from config import config
-from azure_auth import token_manager
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import ProfileConfig, config
+from azure_auth import token_manager_for
+from odata import ODataQuery
+from cache import ResponseCache
+from idempotency import IdempotencyStore
+from jsonstream import ODataStreamParser
+from models import MODELS, BCRecord, Customer, Item, SalesOrder, to_records
+import jsoncodec
+from shared_state import shared_store
+from resilience import (
+    SAFE_METHODS, AdaptiveConcurrencyLimiter, CircuitBreaker, HedgingPolicy, RetryBudget,
+    RetryPolicy, deadline_scope, parse_retry_after, rate_limiter_for, time_remaining
+)
 
 # Configuración global de logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -39,75 +95,940 @@ logging.basicConfig(
 )
 logger = logging.getLogger("bc_client")
 
+# Tiempo mínimo (segundos) que debe quedar de plazo para que merezca la pena otro intento
+_MIN_ATTEMPT_TIME = 0.5
+
+# Margen (segundos) con el que un timeout se atribuye al plazo agotado y no a BC
+_DEADLINE_SLACK = 0.05
+
+# Marcador devuelto por _execute ante un 304 Not Modified (GET condicional)
+_NOT_MODIFIED = object()
+
+# Presupuesto de reintentos compartido por todos los clientes del proceso
+_retry_budget = RetryBudget(config.retry.budget_ratio, config.retry.budget_min_per_sec)
+
+# Comprobación de si una escritura con resultado incierto ya se aplicó en BC: retorna la
+# entidad, None si no existe o lanza `OutcomeUnknownError` si no se pudo comprobar
+Recover = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class OutcomeUnknownError(RuntimeError):
+    """
+    Una escritura pudo haberse aplicado en BC y no se ha podido comprobar: no se reenvía
+    para no duplicarla. Hay que verificarla más tarde (p.ej. con la misma clave de idempotencia).
+    """
+
+# Colector $batch activo en el contexto actual (fijado por BusinessCentralClient.batch())
+_active_batch: ContextVar[Optional["_BatchCollector"]] = ContextVar("bc_active_batch", default=None)
+
+
+class _BatchCollector:
+    """
+    Agrupa peticiones GET que llegan dentro de una ventana temporal y las envía como
+    una única petición JSON `$batch`. Cada llamador recibe su respuesta individual.
+    Las respuestas 429/5xx de un elemento se reintentan por separado fuera del lote.
+    """
+    def __init__(self, client: "BusinessCentralClient", window: float, max_size: int):
+        self._client = client
+        self._window = window
+        self._max_size = max_size
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(
+        self, path: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append(({"path": path, "params": params, "headers": headers}, fut))
+        if len(self._pending) >= self._max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self.flush)
+        return await fut
+
+    def flush(self) -> None:
+        """
+        Envía en segundo plano las peticiones acumuladas hasta ahora.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        task = asyncio.get_running_loop().create_task(self._send(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """
+        Envía lo pendiente y espera a que terminen todos los lotes en vuelo.
+        """
+        self.flush()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _send(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        client = self._client
+        try:
+            if len(pending) == 1:
+                req, fut = pending[0]
+                result = await client._execute("GET", req["path"], params=req["params"], headers=req["headers"])
+                if not fut.done():
+                    fut.set_result(result)
+                return
+            body = {"requests": [
+                {
+                    "id": str(n),
+                    "method": "GET",
+                    "url": client._batch_url(req["path"], req["params"]),
+                    "headers": {"Accept": "application/json", **(req["headers"] or {})},
+                }
+                for n, (req, _) in enumerate(pending)
+            ]}
+            logger.debug(f"BC $batch con {len(pending)} peticiones")
+            res = await client._execute("POST", f"{client.base}/$batch", data=body, cost=len(pending))
+            responses = {r.get("id"): r for r in (res or {}).get("responses", [])}
+            for n, (req, fut) in enumerate(pending):
+                item = responses.get(str(n))
+                status = item.get("status", 0) if item else 0
+                if status in (200, 201):
+                    if not fut.done():
+                        fut.set_result(item.get("body"))
+                elif status == 304:
+                    if not fut.done():
+                        fut.set_result(_NOT_MODIFIED)
+                elif item is None or status == 429 or status >= 500:
+                    # Sin respuesta o error transitorio: se repite la petición de forma individual
+                    result = await client._execute("GET", req["path"], params=req["params"], headers=req["headers"])
+                    if not fut.done():
+                        fut.set_result(result)
+                else:
+                    logger.error(f"BC API GET {req['path']} (en $batch): {status}")
+                    if not fut.done():
+                        fut.set_result(None)
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+
 
 class BusinessCentralClient:
     """
     Cliente asíncrono para la API de Business Central.
     Gestiona autenticación, reintentos y expone métodos de negocio clave.
     """
-    def __init__(self):
-        self.base = config.bc.base_url
-        self.comp = config.bc.company_id
-        self._retries = 3  # Número de reintentos ante errores transitorios
-        self._timeout = 30  # Timeout global para peticiones HTTP (segundos)
+    def __init__(
+        self, company_id: Optional[str] = None,
+        parent: Optional["BusinessCentralClient"] = None,
+        profile: Optional[ProfileConfig] = None
+    ):
+        # Perfil de conexión (tenant, credenciales y entorno); los clientes por compañía heredan el del raíz
+        self.profile = parent.profile if parent else (profile or config.profiles["default"])
+        self.base = self.profile.bc.base_url
+        self.comp = company_id or self.profile.bc.company_id
+        # Cliente raíz del que se comparten pool, limitadores y lista de compañías (None si es la raíz)
+        self._parent = parent
+        # Gestor de tokens de las credenciales del perfil
+        self.tokens = parent.tokens if parent else token_manager_for(self.profile.azure_ad)
+        # Clientes raíz por perfil, compartidos por todos los clientes creados desde el mismo registro
+        self._profile_clients: Dict[str, "BusinessCentralClient"] = (
+            parent._profile_clients if parent else {self.profile.name: self}
+        )
+        # Política de reintentos enchufable (presupuesto compartido por todo el proceso)
+        self.retry_policy = parent.retry_policy if parent else RetryPolicy(
+            config.retry.max_attempts, config.retry.base_delay, config.retry.max_delay,
+            budget=_retry_budget
+        )
+        self._timeout = config.http.timeout  # Timeout global para peticiones HTTP (segundos)
+        self._http: Optional[httpx.AsyncClient] = None  # Cliente HTTP persistente (pool compartido)
+        # Lista de compañías cacheada (expiración, compañías) y clientes por compañía
+        self._companies: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+        self._company_clients: Dict[str, "BusinessCentralClient"] = {}
+        # Agrupación automática de GET en $batch (desactivada si la ventana es 0)
+        window = config.http.batch_window_ms / 1000
+        self._batcher = _BatchCollector(self, window, config.http.batch_max_size) if window > 0 else None
+        # GET idénticos en vuelo (single-flight): clave -> tarea compartida
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        # Caché de lecturas (None si está desactivada)
+        self.cache: Optional[ResponseCache] = ResponseCache(
+            max_entries=config.cache.max_entries,
+            default_ttl=config.cache.default_ttl,
+            ttls=config.cache.ttls,
+            shared=shared_store,
+            scope=f"{self.base}/companies({self.comp})",
+            decode=to_records,
+            generation_ttl=config.cache.generation_ttl,
+        ) if config.cache.enabled else None
+        # Limitador de tasa compartido por tenant/entorno (None si no hay límite)
+        self.rate_limiter = rate_limiter_for(
+            self.profile.bc.tenant_id, self.profile.bc.environment,
+            config.rate_limit.rate, config.rate_limit.burst
+        )
+        # Claves de idempotencia de las escrituras (resultado recordado durante el TTL)
+        self.idempotency = IdempotencyStore(config.idempotency.ttl, config.idempotency.max_entries)
+        # Circuit breakers por entidad ('customers', 'items', '$batch', ...)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Límite adaptativo de peticiones en vuelo (None si está desactivado).
+        # Es la capacidad del entorno BC, así que las compañías comparten el del cliente raíz
+        cc = config.concurrency
+        self.concurrency: Optional[AdaptiveConcurrencyLimiter] = parent.concurrency if parent else (
+            AdaptiveConcurrencyLimiter(
+                cc.initial, cc.min_limit, cc.max_limit, cc.max_wait, cc.latency_tolerance, cc.backoff
+            ) if cc.enabled else None
+        )
+        # Peticiones de cobertura para GET (None si está desactivado)
+        hc = config.hedging
+        self.hedging: Optional[HedgingPolicy] = parent.hedging if parent else (
+            HedgingPolicy(hc.percentile, hc.min_delay, hc.budget_ratio) if hc.enabled else None
+        )
+
+    def _build_http_client(self) -> httpx.AsyncClient:
+        """
+        Construye el cliente HTTP compartido con los límites de pool configurados.
+        Si se pide HTTP/2 pero el paquete 'h2' no está instalado, se usa HTTP/1.1.
+        """
+        http2 = config.http.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("BC_HTTP2 activo pero el paquete 'h2' no está instalado; se usa HTTP/1.1.")
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=config.http.max_connections,
+            max_keepalive_connections=config.http.max_keepalive_connections,
+            keepalive_expiry=config.http.keepalive_expiry,
+        )
+        return httpx.AsyncClient(timeout=self._timeout, limits=limits, http2=http2)
+
+    async def open(self) -> None:
+        """
+        Abre el cliente HTTP persistente. Se invoca desde `app_lifespan` al arrancar el servidor.
+        Es idempotente: si ya está abierto no hace nada.
+        """
+        if self._parent is not None:
+            return await self._parent.open()
+        if self._http is None or self._http.is_closed:
+            self._http = self._build_http_client()
+            logger.info("Pool HTTP de Business Central abierto.")
+
+    async def aclose(self) -> None:
+        """
+        Cierra los clientes HTTP persistentes (el propio y los de los demás perfiles)
+        y libera las conexiones de los pools.
+        """
+        for client in list(self._profile_clients.values()):
+            if client._http is not None and not client._http.is_closed:
+                await client._http.aclose()
+                logger.info(f"Pool HTTP de Business Central cerrado (perfil '{client.profile.name}').")
+            client._http = None
+
+    async def _get_http(self) -> httpx.AsyncClient:
+        """
+        Devuelve el cliente HTTP compartido, abriéndolo bajo demanda si ningún
+        ciclo de vida lo ha hecho (p.ej. BusinessCentralMCP.py en modo CLI).
+        Los clientes por compañía usan el pool del cliente raíz.
+        """
+        if self._parent is not None:
+            return await self._parent._get_http()
+        if self._http is None or self._http.is_closed:
+            await self.open()
+        return self._http
+
+    def _url(self, path: str) -> str:
+        """
+        Construye la URL absoluta de un recurso de la compañía.
+        Las URLs ya absolutas (p.ej. `@odata.nextLink`) se devuelven tal cual.
+        """
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base}/companies({self.comp})/{path}"
+
+    def _entity_of(self, path: str) -> str:
+        """
+        Extrae el nombre de la entidad de una ruta: 'customers(123)' -> 'customers'.
+        """
+        for prefix in (f"{self.base}/companies({self.comp})/", f"{self.base}/"):
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        for sep in ("(", "/", "?"):
+            path = path.split(sep, 1)[0]
+        return path
+
+    def _batch_url(self, path: str, params: Optional[Dict] = None) -> str:
+        """
+        Construye la URL relativa a la raíz de la API que espera cada elemento de un `$batch`.
+        """
+        url = self._url(path)
+        if url.startswith(self.base):
+            url = url[len(self.base):].lstrip("/")
+        if params:
+            url = f"{url}?{httpx.QueryParams(params)}"
+        return url
+
+    @asynccontextmanager
+    async def batch(self, window: Optional[float] = None, max_size: Optional[int] = None):
+        """
+        Agrupa en peticiones `$batch` los GET lanzados dentro del bloque (incluidas las
+        tareas creadas en él, p.ej. con `asyncio.gather`).
+        Parámetros:
+            window (float): Segundos de espera para acumular peticiones (default: config o 2 ms)
+            max_size (int): Peticiones máximas por lote (default: BC_BATCH_MAX_SIZE)
+        Ejemplo:
+            async with bc_client.batch():
+                clientes = await asyncio.gather(*(bc_client.get_customer(i) for i in ids))
+        """
+        if window is None:
+            window = config.http.batch_window_ms / 1000 or 0.002
+        collector = _BatchCollector(self, window, max_size or config.http.batch_max_size)
+        token = _active_batch.set(collector)
+        try:
+            yield collector
+        finally:
+            _active_batch.reset(token)
+            await collector.drain()
 
     async def _request(
         self, method: str, path: str,
         params: Optional[Dict] = None,
-        data: Optional[Dict] = None
+        data: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        query: Optional[ODataQuery] = None,
+        batch: bool = True,
+        coalesce: bool = True,
+        cache: bool = True,
+        recover: Optional[Recover] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Realiza una petición HTTP autenticada a la API de Business Central.
         Maneja reintentos automáticos ante errores 401/5xx y refresca el token si es necesario.
         Parámetros:
             method (str): Método HTTP ('GET', 'POST', etc.)
-            path (str): Ruta relativa dentro de la compañía BC
+            path (str): Ruta relativa dentro de la compañía BC o URL absoluta (nextLink)
             params (dict): Parámetros de query opcionales
             data (dict): Payload JSON para POST/PUT
+            headers (dict): Cabeceras adicionales (p.ej. `Prefer`)
+            query (ODataQuery): Opciones OData; `params` explícitos tienen prioridad
+            batch (bool): Permite agrupar este GET en un `$batch` si hay un colector activo
+            coalesce (bool): Comparte la petición con GET idénticos ya en vuelo
+            cache (bool): Lee/escribe la caché de respuestas (si está activada)
+            recover (callable): Para escrituras, comprueba si un intento fallido ya se aplicó
+                en BC (devuelve la entidad o None); permite reintentarlas como las lecturas
         Retorna:
             Diccionario con la respuesta JSON o None si falla.
+        Notas:
+            - Los GET coalescidos o cacheados devuelven el mismo objeto a todos los
+              llamadores: no debe modificarse in situ.
+        """
+        if query is not None:
+            params = {**query.to_params(), **(params or {})}
+        with deadline_scope(self._default_deadline()):
+            return await self._request_cached(method, path, params, data, headers, batch, coalesce, cache, recover)
+
+    async def _request_cached(
+        self, method: str, path: str,
+        params: Optional[Dict],
+        data: Optional[Dict],
+        headers: Optional[Dict[str, str]],
+        batch: bool,
+        coalesce: bool,
+        cache: bool,
+        recover: Optional[Recover] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Capa de caché (lectura, revalidación con ETag e invalidación tras escrituras).
+        """
+        if method != "GET":
+            result = await self._dispatch(method, path, params, data, headers, batch, recover)
+            if result is not None and self.cache is not None:
+                # Una escritura correcta deja obsoletas las lecturas cacheadas de la entidad
+                await self.cache.invalidate(self._entity_of(path))
+            return result
+        use_cache = cache and self.cache is not None
+        stale = None
+        base_headers = headers
+        if use_cache:
+            key = self._flight_key(method, self._url(path), params, headers)
+            cached = await self.cache.get(key, self._entity_of(path))
+            if cached is not None:
+                return cached
+            # Entrada expirada de una entidad con ETag: GET condicional en lugar de descarga completa
+            stale = self.cache.peek(key)
+            etag = stale.get("@odata.etag") if isinstance(stale, (dict, BCRecord)) else None
+            if etag:
+                headers = {**(headers or {}), "If-None-Match": etag}
+            else:
+                stale = None
+        if coalesce:
+            result = await self._coalesced(path, params, headers, batch)
+        else:
+            result = await self._dispatch(method, path, params, data, headers, batch)
+        if result is _NOT_MODIFIED:
+            if stale is None:
+                # 304 sin copia local (no debería ocurrir): se repite sin condición
+                return await self._dispatch(method, path, params, data, base_headers, batch)
+            logger.debug(f"BC 304 Not Modified: {path}")
+            self.cache.revalidated(key, self._entity_of(path), stale)
+            return stale
+        if use_cache and result is not None:
+            self.cache.set(key, self._entity_of(path), result)
+        return result
+
+    @staticmethod
+    def _flight_key(method: str, url: str, params: Optional[Dict], headers: Optional[Dict]) -> Tuple:
+        """
+        Clave de identidad de una petición: método + URL + parámetros + cabeceras.
+        """
+        def norm(d: Optional[Dict]) -> Tuple:
+            return tuple(sorted((str(k), str(v)) for k, v in (d or {}).items()))
+        return (method, url, norm(params), norm(headers))
+
+    async def _coalesced(
+        self, path: str,
+        params: Optional[Dict],
+        headers: Optional[Dict[str, str]],
+        batch: bool
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Single-flight: si ya hay un GET idéntico en vuelo se espera su resultado en lugar
+        de lanzar otra petición. La tarea compartida está protegida con `shield` para que
+        la cancelación de un llamador no afecte al resto.
+        """
+        key = self._flight_key("GET", self._url(path), params, headers)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._dispatch("GET", path, params, None, headers, batch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            logger.debug(f"BC GET coalescido con petición en vuelo: {path}")
+        return await asyncio.shield(task)
+
+    async def _dispatch(
+        self, method: str, path: str,
+        params: Optional[Dict],
+        data: Optional[Dict],
+        headers: Optional[Dict[str, str]],
+        batch: bool,
+        recover: Optional[Recover] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Envía la petición a través del colector `$batch` activo (solo GET) o directamente.
+        Las lecturas de entidades con modelo (`models.MODELS`) se devuelven como registros
+        compactos, de modo que la caché y los GET coalescidos los comparten ya convertidos.
+        """
+        collector = (_active_batch.get() or self._batcher) if batch and method == "GET" else None
+        if collector is not None:
+            result = await collector.submit(path, params=params, headers=headers)
+        else:
+            result = await self._execute(method, path, params=params, data=data, headers=headers, recover=recover)
+        if method == "GET" and result is not None and result is not _NOT_MODIFIED:
+            result = to_records(self._entity_of(path), result)
+        return result
+
+    def _breaker_for(self, path: str) -> Optional[CircuitBreaker]:
+        """
+        Devuelve el circuit breaker de la entidad de `path` (None si están desactivados).
+        """
+        cb = config.circuit_breaker
+        if cb.failure_threshold <= 0:
+            return None
+        entity = self._entity_of(path)
+        breaker = self._breakers.get(entity)
+        if breaker is None:
+            breaker = self._breakers[entity] = CircuitBreaker(
+                cb.failure_threshold, cb.recovery_timeout, cb.half_open_max_calls
+            )
+        return breaker
+
+    async def _send(
+        self, method: str, url: str,
+        headers: Dict[str, str],
+        params: Optional[Dict],
+        data: Optional[Dict],
+        stream: bool = False,
+        cost: int = 1
+    ) -> Optional[httpx.Response]:
+        """
+        Realiza un único intento HTTP bajo el limitador de concurrencia y el de tasa.
+        Con `stream=True` la respuesta se devuelve sin leer el cuerpo (hay que cerrarla).
+        `cost` es el número de operaciones que cuenta BC (las de un `$batch`).
+        Retorna None si la espera en la cola de concurrencia supera el máximo o si, tras las
+        esperas de los limitadores, ya no queda plazo para un intento útil.
+        """
+        limiter = self.concurrency
+        if limiter is not None and not await limiter.acquire(timeout=time_remaining()):
+            return None
+        overloaded: Optional[bool] = None
+        start = time.monotonic()
+        try:
+            if self.rate_limiter is not None:
+                remaining = time_remaining()
+                budget = None if remaining is None else max(0.0, remaining - _MIN_ATTEMPT_TIME)
+                if await self.rate_limiter.acquire(cost, timeout=budget) is None:
+                    return None
+            if not self._has_time_for(0):
+                return None
+            # La latencia medida excluye la espera del limitador de tasa
+            start = time.monotonic()
+            cli = await self._get_http()
+            remaining = time_remaining()
+            timeout = self._timeout if remaining is None else max(0.001, min(self._timeout, remaining))
+            try:
+                if data is not None:
+                    headers = {**headers, "Content-Type": "application/json"}
+                content = jsoncodec.dumps(data) if data is not None else None
+                req = cli.build_request(method, url, headers=headers, params=params, content=content, timeout=timeout)
+                resp = await cli.send(req, stream=stream)
+            except httpx.TransportError as e:
+                # Un timeout recortado por el plazo de la herramienta no indica que BC esté saturado
+                overloaded = None if self._deadline_timeout(e) else True
+                raise
+            overloaded = resp.status_code == 429 or resp.status_code >= 500
+            return resp
+        finally:
+            if limiter is not None:
+                limiter.release(time.monotonic() - start, overloaded, self._latency_key(method, url, cost))
+
+    def _latency_key(self, method: str, url: str, cost: int) -> str:
+        """
+        Tipo de petición para la latencia base del limitador de concurrencia: método, entidad,
+        colección o entidad suelta y, en `$batch`, el número de operaciones.
+        """
+        entity = self._entity_of(url)
+        single = "(id)" if f"{entity}(" in url else ""
+        return f"{method} {entity}{single}" + (f" x{cost}" if cost > 1 else "")
+
+    async def _send_hedged(
+        self, method: str, url: str,
+        headers: Dict[str, str],
+        params: Optional[Dict],
+        data: Optional[Dict],
+        cost: int = 1
+    ) -> Optional[httpx.Response]:
+        """
+        Igual que `_send`, pero para GET con hedging activo: si no hay respuesta dentro del
+        retardo de la política se lanza una petición idéntica, se devuelve la primera
+        respuesta y se cancela la otra.
+        """
+        policy = self.hedging
+        if policy is None or method != "GET":
+            return await self._send(method, url, headers, params, data, cost=cost)
+        policy.record_request()
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._send(method, url, headers, params, data))
+        tasks = {primary}
+        try:
+            delay = policy.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and policy.try_hedge():
+                    logger.debug(f"BC hedge tras {delay:.3f}s: {url}")
+                    tasks.add(asyncio.ensure_future(self._send(method, url, headers, params, data)))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not primary:
+                        policy.hedge_wins += 1
+                    policy.record_latency(time.monotonic() - start)
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _default_deadline() -> Optional[float]:
+        """
+        Plazo por defecto de la configuración si la herramienta no fijó uno (None si ya hay plazo).
+        """
+        return config.http.deadline if time_remaining() is None and config.http.deadline > 0 else None
+
+    @staticmethod
+    def _deadline_timeout(error: BaseException) -> bool:
+        """
+        Indica si `error` es un timeout provocado por el agotamiento del plazo de la petición
+        (y no por la lentitud de BC).
+        """
+        remaining = time_remaining()
+        return isinstance(error, httpx.TimeoutException) and remaining is not None and remaining <= _DEADLINE_SLACK
+
+    @staticmethod
+    def _has_time_for(delay: float) -> bool:
+        """
+        Indica si, tras esperar `delay` segundos, aún quedará plazo para otro intento.
+        """
+        remaining = time_remaining()
+        return remaining is None or remaining >= delay + _MIN_ATTEMPT_TIME
+
+    async def _execute(
+        self, method: str, path: str,
+        params: Optional[Dict] = None,
+        data: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        stream: bool = False,
+        cost: int = 1,
+        recover: Optional[Recover] = None
+    ) -> Optional[Any]:
+        """
+        Ejecuta la petición HTTP con autenticación, limitación de tasa, circuit breaker y
+        reintentos según `self.retry_policy` (401/429/5xx y errores de transporte).
+        Con `stream=True` devuelve la respuesta 200 abierta y sin leer (sin hedging): el
+        llamador consume `aiter_bytes()` y la cierra con `aclose()`.
+        `cost` indica cuántas operaciones consume la petición en el limitador de tasa.
+        Con `recover` una escritura se reintenta como una lectura: antes de reenviarla tras un
+        fallo de resultado incierto se llama a `recover()` y, si la entidad ya existe, se devuelve;
+        si no se puede comprobar, se propaga `OutcomeUnknownError`.
         """
-        url = f"{self.base}/companies({self.comp})/{path}"
-        for i in range(self._retries):
+        url = self._url(path)
+        breaker = self._breaker_for(path)
+        policy = self.retry_policy
+        # Un $batch solo de GET se puede repetir como cualquier lectura; con escrituras, no
+        idempotent = method in SAFE_METHODS or recover is not None or (
+            self._entity_of(path) == "$batch"
+            and all(r.get("method") == "GET" for r in (data or {}).get("requests", []))
+        )
+        policy.record_request()
+        resp: Optional[httpx.Response] = None
+        attempt = 0
+        while True:
+            if not self._has_time_for(0):
+                logger.error(f"BC API {method} {path}: plazo agotado, no se intenta de nuevo.")
+                return None
             # DEBUG: mostrar intento de solicitud
-            url = f"{self.base}/companies({self.comp})/{path}"
-            logger.debug(f"BC Request #{i+1}: {method} {url} params={params} data={data}")
-            token = await token_manager.get_token()
+            logger.debug(f"BC Request #{attempt+1}: {method} {url} params={params} data={data}")
+            token = await self.tokens.get_token(timeout=time_remaining())
             if not token:
                 logger.error("No se pudo obtener el token de autenticación.")
                 return None
-            headers = {
+            if breaker is not None and not breaker.allow():
+                logger.error(f"Circuito abierto para '{self._entity_of(path)}': BC no disponible, fallo rápido.")
+                return None
+            req_headers = {
                 "Authorization": f"Bearer {token}",
                 "Accept": "application/json"
             }
-            async with httpx.AsyncClient(timeout=self._timeout) as cli:
-                resp = await cli.request(method, url, headers=headers, params=params, json=data)
-            # DEBUG: mostrar respuesta
-            logger.debug(f"BC Response {resp.status_code}: {resp.text[:200]}")
-            if resp.status_code in (200, 201):
-                return resp.json()
-            if resp.status_code == 401:
-                token_manager._token = None
-                logger.warning("Token expirado o inválido. Reintentando...")
-                continue
-            if resp.status_code >= 500:
-                logger.warning(f"Error {resp.status_code} en Business Central. Reintentando...")
-                await asyncio.sleep(2 ** i)
-                continue
-            break
-        logger.error(f"BC API {method} {path}: {resp.status_code}")
+            if headers:
+                req_headers.update(headers)
+            error: Optional[httpx.TransportError] = None
+            status: Optional[int] = None
+            try:
+                if stream:
+                    resp = await self._send(method, url, req_headers, params, data, stream=True)
+                else:
+                    resp = await self._send_hedged(method, url, req_headers, params, data, cost=cost)
+            except httpx.TransportError as e:
+                error, resp = e, None
+                if breaker is not None:
+                    if self._deadline_timeout(e):
+                        breaker.release()
+                    else:
+                        breaker.record_failure()
+            except BaseException:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            else:
+                if resp is None:
+                    if breaker is not None:
+                        breaker.release()
+                    logger.error(f"BC API {method} {path}: sin turno en los limitadores dentro del plazo, petición descartada.")
+                    return None
+                status = resp.status_code
+                if stream:
+                    if status == 200:
+                        if breaker is not None:
+                            breaker.record_success()
+                        return resp
+                    # Respuesta de error: leer el cuerpo (pequeño) y liberar la conexión
+                    await resp.aread()
+                if breaker is not None:
+                    if status >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                # DEBUG: mostrar respuesta (sin decodificar el cuerpo si el nivel no lo requiere)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"BC Response {status}: {resp.text[:200]}")
+                if status in (200, 201):
+                    return jsoncodec.loads(resp.content)
+                if status == 304:
+                    return _NOT_MODIFIED
+                if status == 401:
+                    self.tokens.invalidate(token)
+            # A partir de aquí el intento ha fallado: decidir si se reintenta y cuándo
+            reason = f"Error de red con Business Central ({error!r})" if error is not None \
+                else f"Error {status} en Business Central"
+            if status == 401:
+                delay = 0.0  # Token renovado: reintento inmediato
+            elif status == 429:
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                delay = policy.backoff(attempt) if retry_after is None else retry_after
+                if self.rate_limiter is not None:
+                    # La pausa se aplica a todas las llamadas del tenant vía el limitador
+                    self.rate_limiter.throttle(delay)
+            else:
+                delay = policy.backoff(attempt)
+            # Una escritura que pudo llegar a BC (timeout de lectura, conexión cortada, 5xx) no se
+            # reenvía a ciegas, sea cual sea la política enchufada: podría duplicarse
+            if not idempotent and RetryPolicy.outcome_unknown(status, error):
+                break
+            if not policy.is_retryable(idempotent, status, error):
+                break
+            if attempt + 1 >= policy.max_attempts:
+                logger.warning(f"{reason}. Intentos agotados ({policy.max_attempts}).")
+                break
+            if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"{reason}. Circuito abierto.")
+                break
+            if not self._has_time_for(delay):
+                logger.warning(f"{reason}. Sin plazo para reintentar (espera {delay:.1f}s).")
+                break
+            # Las renovaciones de token no consumen presupuesto: no suponen carga extra para BC
+            if status != 401 and not policy.try_spend():
+                logger.warning(f"{reason}. Presupuesto de reintentos agotado, no se reintenta.")
+                break
+            logger.warning(f"{reason}. Reintentando en {delay:.1f}s...")
+            if delay > 0 and not (status == 429 and self.rate_limiter is not None):
+                await asyncio.sleep(delay)
+            if recover is not None and policy.outcome_unknown(status, error):
+                # Si no se puede comprobar, `recover` lanza OutcomeUnknownError y no se reenvía
+                existing = await recover()
+                if existing is not None:
+                    logger.warning(f"BC API {method} {path}: la escritura ya se había aplicado, no se reenvía.")
+                    return existing
+            attempt += 1
+        if recover is not None and policy.outcome_unknown(status, error):
+            # El último intento pudo aplicarse: se comprueba antes de darlo por fallido, porque
+            # devolver None liberaría la clave de idempotencia para un nuevo POST
+            existing = await recover()
+            if existing is not None:
+                logger.warning(f"BC API {method} {path}: la escritura ya se había aplicado.")
+                return existing
+        logger.error(f"BC API {method} {path}: {status if status is not None else 'sin respuesta'}")
+        return None
+
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas operativas del cliente (caché, limitador de tasa, ...), incluidas
+        las de los demás perfiles en uso.
+        """
+        return {
+            **self._own_stats(),
+            "profiles": {
+                name: c._own_stats() for name, c in self._profile_clients.items()
+                if c is not (self._parent or self)
+            },
+        }
+
+    def degraded(self) -> bool:
+        """
+        Indica si algún circuit breaker no está cerrado, en cualquier perfil en uso y en
+        cualquiera de sus compañías.
+        """
+        roots = {id(c): c for c in (self._parent or self, *self._profile_clients.values())}
+        return any(
+            breaker.state != CircuitBreaker.CLOSED
+            for root in roots.values()
+            for client in (root, *root._company_clients.values())
+            for breaker in client._breakers.values()
+        )
+
+    def _own_stats(self) -> Dict[str, Any]:
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "rate_limiter": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            "circuit_breakers": {name: b.stats() for name, b in self._breakers.items()},
+            "concurrency": self.concurrency.stats() if self.concurrency is not None else None,
+            "hedging": self.hedging.stats() if self.hedging is not None else None,
+            "retry_budget": self.retry_policy.budget.stats() if self.retry_policy.budget is not None else None,
+            "idempotency": self.idempotency.stats(),
+            "companies": {
+                cid: {
+                    "cache": c.cache.stats() if c.cache is not None else None,
+                    "circuit_breakers": {name: b.stats() for name, b in c._breakers.items()},
+                }
+                for cid, c in self._company_clients.items()
+            },
+        }
+
+
+    async def list_companies(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Devuelve las compañías del entorno BC (id, name, displayName...), cacheadas durante
+        `BC_COMPANIES_TTL` segundos y compartidas por todos los clientes por compañía.
+        Parámetros:
+            refresh (bool): Fuerza la recarga desde BC.
+        Retorna:
+            Lista de diccionarios con compañías (la última conocida si BC no responde).
+        """
+        root = self._parent or self
+        cached = root._companies
+        if cached is not None and not refresh and time.monotonic() < cached[0]:
+            return cached[1]
+        res = await root._request("GET", f"{self.base}/companies", cache=False)
+        if res is None:
+            logger.error("No se pudo obtener la lista de compañías de Business Central.")
+            return cached[1] if cached is not None else []
+        companies = res.get("value", [])
+        root._companies = (time.monotonic() + config.cache.companies_ttl, companies)
+        return companies
+
+    async def resolve_company(self, company: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca una compañía por id, name o displayName (sin distinguir mayúsculas).
+        Retorna la compañía o None si no existe.
+        """
+        key = company.strip().lower()
+        for c in await self.list_companies():
+            if key in (str(c.get("id", "")).lower(), str(c.get("name", "")).lower(),
+                       str(c.get("displayName", "")).lower()):
+                return c
         return None
 
+    async def for_company(self, company: Optional[str] = None) -> "BusinessCentralClient":
+        """
+        Devuelve el cliente de una compañía (por id, name o displayName). Cada compañía tiene
+        su propia caché, circuit breakers e idempotencia, pero comparte con el cliente raíz
+        el pool HTTP, el limitador de tasa y el de concurrencia.
+        Parámetros:
+            company (str): Compañía a usar; None o vacío devuelve la de `BC_COMPANY_ID`.
+        Retorna:
+            Cliente de la compañía. Lanza ValueError si la compañía no existe.
+        """
+        root = self._parent or self
+        if not company:
+            return root
+        if company in (root.comp, *root._company_clients):
+            cid = company
+        else:
+            info = await self.resolve_company(company)
+            if info is None:
+                raise ValueError(f"Compañía '{company}' no encontrada en Business Central")
+            cid = info["id"]
+        if cid == root.comp:
+            return root
+        client = root._company_clients.get(cid)
+        if client is None:
+            client = root._company_clients[cid] = BusinessCentralClient(company_id=cid, parent=root)
+        return client
+
+    def for_profile(self, profile: Optional[str] = None) -> "BusinessCentralClient":
+        """
+        Devuelve el cliente raíz de un perfil de conexión de `config.profiles`. Cada perfil
+        tiene su propio token, pool HTTP, limitadores de tasa y concurrencia, cachés y
+        circuit breakers; el cliente se crea la primera vez que se usa.
+        Parámetros:
+            profile (str): Nombre del perfil; None o vacío devuelve el perfil 'default'.
+        Retorna:
+            Cliente del perfil. Lanza ValueError si el perfil no está configurado.
+        """
+        name = profile or "default"
+        client = self._profile_clients.get(name)
+        if client is None:
+            cfg = config.profiles.get(name)
+            if cfg is None:
+                raise ValueError(f"Perfil '{name}' no configurado (ver BC_PROFILES)")
+            client = BusinessCentralClient(profile=cfg)
+            client._profile_clients = self._profile_clients
+            self._profile_clients[name] = client
+        return client
+
+    async def select(
+        self, profile: Optional[str] = None, company: Optional[str] = None
+    ) -> "BusinessCentralClient":
+        """
+        Devuelve el cliente de un perfil y una compañía (ver `for_profile` y `for_company`).
+        Lanza ValueError si el perfil o la compañía no existen.
+        """
+        return await self.for_profile(profile).for_company(company)
+
+    async def fan_out(
+        self, operation: Callable[["BusinessCentralClient"], Awaitable[Any]],
+        companies: Optional[List[str]] = None
+    ) -> List[Tuple[Dict[str, Any], Any]]:
+        """
+        Ejecuta `operation(cliente)` en varias compañías a la vez (todas por defecto).
+        Parámetros:
+            operation (callable): Corrutina que recibe el cliente de cada compañía.
+            companies (list): Compañías a consultar (id, name o displayName); None = todas.
+        Retorna:
+            Lista de (compañía, resultado); el resultado es None si la compañía falló.
+        """
+        all_companies = await self.list_companies()
+        if companies:
+            wanted = {c.strip().lower() for c in companies}
+            targets = [c for c in all_companies if wanted & {
+                str(c.get("id", "")).lower(), str(c.get("name", "")).lower(), str(c.get("displayName", "")).lower()
+            }]
+        else:
+            targets = all_companies
+
+        async def run(company: Dict[str, Any]) -> Any:
+            try:
+                return await operation(await self.for_company(company["id"]))
+            except Exception as e:
+                logger.error(f"Fan-out en la compañía {company.get('name')}: {e!r}")
+                return None
+
+        results = await asyncio.gather(*(run(c) for c in targets))
+        return list(zip(targets, results))
+
+    async def find_customers_all_companies(
+        self, search: str, top: int = 5,
+        companies: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Busca un cliente en todas las compañías a la vez por número, email o parte del nombre.
+        Parámetros:
+            search (str): Número exacto, email exacto o texto contenido en el nombre.
+            top (int): Coincidencias máximas por compañía (default 5).
+            companies (list): Limita la búsqueda a estas compañías (opcional).
+        Retorna:
+            Lista de clientes con `companyId` y `companyName` añadidos.
+        """
+        literal = search.replace("'", "''")
+        query = ODataQuery(filter=(
+            f"number eq '{literal}' or email eq '{literal}' or contains(displayName,'{literal}')"
+        ))
+        results = await self.fan_out(lambda c: c.get_customers(top=top, query=query), companies)
+        merged: List[Dict[str, Any]] = []
+        for company, customers in results:
+            for customer in customers or []:
+                merged.append({
+                    **customer.to_dict(),
+                    "companyId": company.get("id"),
+                    "companyName": company.get("name"),
+                })
+        return merged
+
 
-    async def get_customers(self, top: int = 20) -> List[Dict]:
+    async def get_customers(
+        self, top: int = 20,
+        query: Optional[ODataQuery] = None,
+        use_cache: bool = True
+    ) -> List[Customer]:
         """
         Obtiene una lista de clientes de Business Central.
         Parámetros:
             top (int): Número máximo de clientes a retornar (default 20).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+            use_cache (bool): False para ignorar la caché y leer de BC (default True).
         Retorna:
-            Lista de diccionarios con clientes.
+            Lista de registros `Customer` (usa `to_dict()` para la salida).
         """
-        res = await self._request("GET", f"customers", params={"$top": top})
+        res = await self._request("GET", "customers", params={"$top": top}, query=query, cache=use_cache)
         if res:
             logger.info(f"Clientes recuperados: {len(res.get('value', []))}")
         else:
@@ -115,53 +1036,381 @@ class BusinessCentralClient:
         return res.get("value", []) if res else []
 
 
-    async def get_customer(self, cid: str) -> Optional[Dict]:
+    async def get_customer(
+        self, cid: str,
+        query: Optional[ODataQuery] = None,
+        use_cache: bool = True
+    ) -> Optional[Customer]:
         """
         Obtiene el detalle de un cliente por su ID.
         Parámetros:
             cid (str): ID único del cliente en BC.
+            query (ODataQuery): Proyección/expansión opcional ($select, $expand).
+            use_cache (bool): False para ignorar la caché y leer de BC (default True).
         Retorna:
-            Diccionario con los datos del cliente o None si no existe.
+            Registro `Customer` o None si no existe.
         """
-        return await self._request("GET", f"customers({cid})")
+        return await self._request("GET", f"customers({cid})", query=query, cache=use_cache)
 
 
-    async def get_items(self, top: int = 20) -> List[Dict]:
+    async def get_items(
+        self, top: int = 20,
+        query: Optional[ODataQuery] = None,
+        use_cache: bool = True
+    ) -> List[Item]:
         """
         Lista artículos de Business Central.
         Parámetros:
             top (int): Número máximo de artículos a retornar (default 20).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+            use_cache (bool): False para ignorar la caché y leer de BC (default True).
         Retorna:
-            Lista de diccionarios con artículos.
+            Lista de registros `Item`.
         """
-        res = await self._request("GET", "items", params={"$top": top})
+        res = await self._request("GET", "items", params={"$top": top}, query=query, cache=use_cache)
         return res.get("value", []) if res else []
 
 
-    async def get_orders(self, top: int = 10) -> List[Dict]:
+    async def get_orders(
+        self, top: int = 10,
+        query: Optional[ODataQuery] = None,
+        use_cache: bool = True
+    ) -> List[SalesOrder]:
         """
         Lista órdenes de venta de Business Central.
         Parámetros:
             top (int): Número máximo de órdenes a retornar (default 10).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+            use_cache (bool): False para ignorar la caché y leer de BC (default True).
         Retorna:
-            Lista de diccionarios con órdenes de venta.
+            Lista de registros `SalesOrder`.
         """
-        res = await self._request("GET", "salesOrders", params={"$top": top})
+        res = await self._request("GET", "salesOrders", params={"$top": top}, query=query, cache=use_cache)
         return res.get("value", []) if res else []
 
 
-    async def create_customer(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def _iter_collection(
+        self, path: str,
+        params: Optional[Dict] = None,
+        page_size: Optional[int] = None,
+        query: Optional[ODataQuery] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Recorre una colección completa siguiendo `@odata.nextLink` de forma perezosa.
+        Cada página se lee en streaming y se decodifica registro a registro
+        (`ODataStreamParser`): la memoria máxima depende de un registro, no del tamaño de
+        página. La siguiente página se pide cuando el consumidor ha agotado la anterior.
+        Parámetros:
+            path (str): Colección relativa a la compañía ('customers', 'items', ...)
+            params (dict): Parámetros de query de la primera página
+            page_size (int): Tamaño de página sugerido al servidor (`Prefer: odata.maxpagesize`)
+            query (ODataQuery): Opciones OData de la primera página
+        Retorna:
+            Iterador asíncrono de registros (tipados si la entidad tiene modelo).
+        """
+        headers = {"Prefer": f"odata.maxpagesize={page_size}"} if page_size else None
+        model = MODELS.get(self._entity_of(path))
+        next_url: Optional[str] = path
+        next_params = params
+        next_query = query
+        while next_url:
+            if next_query is not None:
+                next_params = {**next_query.to_params(), **(next_params or {})}
+            # Los recorridos completos no pasan por la caché ni por $batch: se leen en streaming
+            with deadline_scope(self._default_deadline()):
+                resp = await self._execute("GET", next_url, params=next_params, headers=headers, stream=True)
+            if resp is None:
+                logger.error(f"Paginación interrumpida en {path}: no se pudo obtener la página.")
+                return
+            parser = ODataStreamParser()
+            try:
+                async for chunk in resp.aiter_bytes():
+                    for record in parser.feed(chunk):
+                        yield model.from_dict(record) if model else record
+                for record in parser.close():
+                    yield model.from_dict(record) if model else record
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error(f"Paginación interrumpida en {path}: error leyendo la página ({e!r}).")
+                return
+            finally:
+                await resp.aclose()
+            # El nextLink ya incluye la query completa ($skiptoken, filtros...)
+            next_url = parser.meta.get("@odata.nextLink")
+            next_params = next_query = None
+
+
+    def iter_customers(
+        self, page_size: Optional[int] = None,
+        query: Optional[ODataQuery] = None
+    ) -> AsyncIterator[Customer]:
+        """
+        Itera todos los clientes de Business Central siguiendo la paginación del servidor.
+        Parámetros:
+            page_size (int): Tamaño de página sugerido (opcional).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+        Retorna:
+            Iterador asíncrono de registros `Customer`.
+        Ejemplo:
+            async for c in bc_client.iter_customers():
+                ...
+        """
+        return self._iter_collection("customers", page_size=page_size, query=query)
+
+
+    def iter_items(
+        self, page_size: Optional[int] = None,
+        query: Optional[ODataQuery] = None
+    ) -> AsyncIterator[Item]:
+        """
+        Itera todos los artículos de Business Central siguiendo la paginación del servidor.
+        Parámetros:
+            page_size (int): Tamaño de página sugerido (opcional).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+        Retorna:
+            Iterador asíncrono de registros `Item`.
+        """
+        return self._iter_collection("items", page_size=page_size, query=query)
+
+
+    def iter_orders(
+        self, page_size: Optional[int] = None,
+        query: Optional[ODataQuery] = None
+    ) -> AsyncIterator[SalesOrder]:
+        """
+        Itera todas las órdenes de venta de Business Central siguiendo la paginación del servidor.
+        Parámetros:
+            page_size (int): Tamaño de página sugerido (opcional).
+            query (ODataQuery): Proyección, filtro y orden opcionales.
+        Retorna:
+            Iterador asíncrono de registros `SalesOrder`.
+        """
+        return self._iter_collection("salesOrders", page_size=page_size, query=query)
+
+
+    async def count(self, path: str, params: Optional[Dict] = None) -> Optional[int]:
+        """
+        Devuelve el número total de registros de una colección (`$count=true`, sin registros).
+        Parámetros:
+            path (str): Colección relativa a la compañía
+            params (dict): Parámetros de query adicionales (p.ej. `$filter`)
+        Retorna:
+            Número de registros o None si falla.
+        """
+        q = dict(params or {})
+        q.update({"$count": "true", "$top": 0})
+        res = await self._request("GET", path, params=q, cache=False)
+        if not res or "@odata.count" not in res:
+            return None
+        return int(res["@odata.count"])
+
+
+    async def bulk_fetch(
+        self, entity: str,
+        window: int = 1000,
+        concurrency: int = 4,
+        orderby: str = "number",
+        query: Optional[ODataQuery] = None
+    ) -> List[Dict]:
+        """
+        Extrae una colección completa partiéndola en ventanas `$skip`/`$top` que se
+        descargan en paralelo (limitadas por un semáforo) y se fusionan en orden.
+        Pensado para extracciones nocturnas de 'customers', 'items' o 'salesOrders',
+        donde el cuello de botella es la latencia de ida y vuelta y no el ancho de banda.
+        Parámetros:
+            entity (str): Colección a extraer ('customers', 'items', 'salesOrders')
+            window (int): Registros por partición (default 1000)
+            concurrency (int): Particiones descargadas a la vez (default 4)
+            orderby (str): Clave de ordenación estable para que las ventanas no se solapen
+            query (ODataQuery): Proyección/filtro opcionales ($top/$skip se ignoran)
+        Retorna:
+            Lista con todos los registros en el orden de `orderby`.
+        """
+        if window < 1 or concurrency < 1:
+            raise ValueError("window y concurrency deben ser mayores que 0")
+        base = (query or ODataQuery()).with_page()
+        if not base.orderby:
+            base = replace(base, orderby=[orderby])
+        total = await self.count(entity, params={"$filter": base.filter} if base.filter else None)
+        if total is None:
+            logger.error(f"No se pudo contar la colección {entity}; se usa paginación secuencial.")
+            return [r async for r in self._iter_collection(entity, query=base)]
+        sem = asyncio.Semaphore(concurrency)
+
+        async def fetch_window(skip: int) -> List[Dict]:
+            async with sem:
+                # Cada ventana puede a su vez venir paginada por el servidor
+                return [r async for r in self._iter_collection(entity, query=base.with_page(top=window, skip=skip))]
+
+        partitions = await asyncio.gather(*(fetch_window(skip) for skip in range(0, total, window)))
+        records = [r for part in partitions for r in part]
+        logger.info(f"Extracción de {entity}: {len(records)}/{total} registros en {len(partitions)} particiones")
+        return records
+
+
+    async def create_customer(
+        self, data: Dict[str, Any],
+        idempotency_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Crea un nuevo cliente en Business Central.
         Parámetros:
             data (dict): Diccionario con los campos del nuevo cliente según la API de BC.
+            idempotency_key (str): Clave de la operación; repetirla dentro de
+                `BC_IDEMPOTENCY_TTL` devuelve el cliente ya creado (se genera una si no se indica).
         Retorna:
             Respuesta JSON del nuevo cliente o None en caso de error.
         Notas:
             - Consulta la documentación oficial para el esquema de datos requerido.
+            - Tras un fallo de resultado incierto (5xx, timeout) se busca el cliente por
+              `number` o `email` antes de reenviar el POST, para no duplicarlo. Si la búsqueda
+              falla se lanza `OutcomeUnknownError`; sin `number` ni `email` no se reenvía.
+              También se busca tras el último intento fallido y antes del primer POST si la
+              `idempotency_key` ya se usó en un intento que no devolvió resultado.
+        """
+        key = idempotency_key or uuid.uuid4().hex
+        # Sin un campo por el que buscarlo no se puede comprobar si el POST llegó: sin reintento
+        recover = (lambda: self._find_customer(data)) if self._customer_lookup_fields(data) else None
+
+        async def create() -> Optional[Dict[str, Any]]:
+            # La clave ya se usó en un intento fallido: ese POST pudo llegar a aplicarse
+            if recover is not None and idempotency_key and self.idempotency.attempted(key):
+                existing = await recover()
+                if existing is not None:
+                    return existing
+            # POST a la colección 'customers'
+            return await self._request("POST", "customers", data=data, recover=recover)
+
+        return await self.idempotency.run(key, create)
+
+    @staticmethod
+    def _customer_lookup_fields(data: Dict[str, Any]) -> List[str]:
+        """
+        Campos de `data` por los que se puede localizar el cliente en BC (`number`, `email`).
+        """
+        return [field for field in ("number", "email") if data.get(field)]
+
+    async def _find_customer(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Busca en BC un cliente que coincida por `number` o, en su defecto, por `email`.
+        Retorna el cliente encontrado o None si no existe. Lanza `OutcomeUnknownError` si
+        no hay campos por los que buscar o si alguna búsqueda falla: un fallo de la consulta
+        no prueba que el cliente no exista.
+        """
+        fields = self._customer_lookup_fields(data)
+        if not fields:
+            raise OutcomeUnknownError("El cliente no tiene 'number' ni 'email': no se puede comprobar si ya existe")
+        for field in fields:
+            literal = str(data[field]).replace("'", "''")
+            res = await self._execute("GET", "customers", params={"$filter": f"{field} eq '{literal}'", "$top": 1})
+            if res is None:
+                raise OutcomeUnknownError(
+                    f"No se pudo comprobar en Business Central si el cliente ya existe (búsqueda por {field})"
+                )
+            rows = res.get("value")
+            if rows:
+                return rows[0]
+        return None
+
+
+    async def create_customers(
+        self, customers: List[Dict[str, Any]],
+        changeset_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        atomic: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """
+        Crea clientes en bloque agrupándolos en peticiones `$batch` que se envían en
+        paralelo (cada lote consume tantos tokens del limitador de tasa como registros).
+        Parámetros:
+            customers (list): Diccionarios con los campos de cada cliente según la API de BC.
+            changeset_size (int): Registros por lote (default `BC_BULK_CHANGESET_SIZE`).
+            concurrency (int): Lotes en vuelo a la vez (default `BC_BULK_CONCURRENCY`).
+            atomic (bool): Si True cada lote es un changeset todo-o-nada (default `BC_BULK_ATOMIC`).
+        Retorna:
+            {"total", "created", "failed", "results"}; `results` tiene una entrada por registro,
+            en el orden de entrada, con `index`, `ok`, `status` y `customer` o `error`.
+        Notas:
+            - Un lote sin respuesta (error de red, 5xx, plazo agotado) no se repite porque
+              contiene escrituras: sus registros se marcan como fallidos de resultado incierto.
+            - Sin `atomic`, los registros rechazados con 429 se reintentan individualmente
+              mientras quede plazo.
+            - Un error inesperado en un lote solo afecta a sus registros (resultado incierto):
+              el informe se devuelve siempre.
         """
-        # POST a la colección 'customers'
-        return await self._request("POST", "customers", data=data)
+        bulk = config.bulk
+        size = changeset_size or bulk.changeset_size
+        atomic = bulk.atomic if atomic is None else atomic
+        sem = asyncio.Semaphore(concurrency or bulk.concurrency)
+        results: List[Dict[str, Any]] = [{} for _ in customers]
+
+        async def send(start: int) -> None:
+            async with sem:
+                with deadline_scope(self._default_deadline()):
+                    try:
+                        await self._send_changeset(customers, start, size, atomic, results)
+                    except Exception as e:
+                        # Un lote que falla no arrastra a los demás (que BC pudo haber aplicado)
+                        logger.error(f"Error enviando el lote $batch desde el registro {start}: {e!r}")
+                        for i in range(start, min(start + size, len(customers))):
+                            if not results[i]:
+                                results[i] = {"index": i, "ok": False, "status": None,
+                                              "error": f"Error enviando el lote ({e!r}): el resultado es incierto"}
+
+        await asyncio.gather(*(send(start) for start in range(0, len(customers), size)))
+        created = sum(1 for r in results if r.get("ok"))
+        if created and self.cache is not None:
+            await self.cache.invalidate("customers")
+        logger.info(f"Alta masiva de clientes: {created}/{len(customers)} creados")
+        return {"total": len(customers), "created": created, "failed": len(customers) - created, "results": results}
+
+    async def _send_changeset(
+        self, customers: List[Dict[str, Any]],
+        start: int, size: int, atomic: bool,
+        results: List[Dict[str, Any]]
+    ) -> None:
+        """
+        Envía `customers[start:start+size]` en un único `$batch` y rellena `results`.
+        """
+        indexes = range(start, min(start + size, len(customers)))
+        body = {"requests": [
+            {
+                "id": str(i),
+                "method": "POST",
+                "url": self._batch_url("customers"),
+                "headers": {"Content-Type": "application/json", "Accept": "application/json"},
+                "body": customers[i],
+                **({"atomicityGroup": f"changeset{start}"} if atomic else {}),
+            }
+            for i in indexes
+        ]}
+        res = await self._execute("POST", f"{self.base}/$batch", data=body, cost=len(indexes))
+        if res is None:
+            for i in indexes:
+                results[i] = {"index": i, "ok": False, "status": None,
+                              "error": "El lote $batch no obtuvo respuesta: el resultado es incierto"}
+            return
+        responses = {r.get("id"): r for r in res.get("responses", [])}
+        for i in indexes:
+            item = responses.get(str(i))
+            status = item.get("status") if item else None
+            item_body = (item or {}).get("body") or {}
+            if status in (200, 201):
+                results[i] = {"index": i, "ok": True, "status": status, "customer": item_body}
+            elif status == 429 and not atomic and not self._has_time_for(0):
+                results[i] = {"index": i, "ok": False, "status": 429,
+                              "error": "Throttling de Business Central (429); plazo agotado, no se reintenta"}
+            elif status == 429 and not atomic:
+                # Rechazado sin procesar: se repite por separado con la política de reintentos
+                created = await self._execute("POST", "customers", data=customers[i])
+                results[i] = {"index": i, "ok": True, "status": 201, "customer": created} if created else \
+                    {"index": i, "ok": False, "status": 429, "error": "Throttling de Business Central (429)"}
+            elif item is None:
+                results[i] = {"index": i, "ok": False, "status": None,
+                              "error": "Sin respuesta en el $batch (changeset revertido por otro registro)"}
+            else:
+                error = item_body.get("error", {}) if isinstance(item_body, dict) else {}
+                results[i] = {"index": i, "ok": False, "status": status,
+                              "error": error.get("message") or f"Error {status} en Business Central"}
 
 
 # Instancia compartida para uso global
@@ -10,6 +10,20 @@ Características principales:
   - Expone modelos Pydantic para tipado y validación:
       * AzureADConfig: configuración de autenticación Azure AD.
       * BusinessCentralConfig: configuración de la API de BC.
+      * HttpClientConfig: pool de conexiones HTTP persistente hacia BC.
+      * CacheConfig: caché de respuestas con TTL por entidad.
+      * RateLimitConfig: limitador de tasa hacia BC (token bucket).
+      * CircuitBreakerConfig: umbrales del circuit breaker por endpoint.
+      * ConcurrencyConfig: límite adaptativo (AIMD) de peticiones en vuelo hacia BC.
+      * HedgingConfig: peticiones de cobertura para reducir la latencia de cola en lecturas.
+      * RetryConfig: política de reintentos (backoff con jitter y presupuesto global).
+      * BulkWriteConfig: altas masivas mediante `$batch` (tamaño de lote y concurrencia).
+      * IdempotencyConfig: caducidad y tamaño del almacén de claves de idempotencia.
+      * WriteQueueConfig: cola SQLite de escrituras diferidas (create_customer en segundo plano).
+      * TokenCacheConfig: caché persistente en disco de tokens de Azure AD (arranques en frío).
+      * SharedStateConfig: estado compartido entre workers de la misma máquina (tokens y cachés).
+      * ProfileConfig: perfil con nombre (tenant, app de Azure AD y entorno BC) seleccionable
+        por llamada; `BC_PROFILES` declara perfiles adicionales al 'default'.
   - Crea una instancia global `config` con los valores validados y accesibles en toda la app.
 
 Onboarding rápido:
@@ -24,8 +38,9 @@ Referencias útiles:
 """
 import os
 import logging
+import tempfile
 from dotenv import load_dotenv, find_dotenv
-from typing import Optional
+from typing import Dict, Literal, Optional
 from pydantic import BaseModel, Field, model_validator
 import sys
 
@@ -42,6 +57,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger("config")
 
+# Directorio por defecto de los ficheros locales de estado: fuera del repositorio, para que
+# nunca acaben en git ni en el ZIP de despliegue
+DATA_DIR = os.path.join(tempfile.gettempdir(), "bc-mcp")
+
 
 class AzureADConfig(BaseModel):
     """
@@ -52,6 +71,10 @@ class AzureADConfig(BaseModel):
     client_id: str = Field(..., description="Azure AD Application ID")
     client_secret: str = Field(..., description="Azure AD Client Secret")
     authority: Optional[str] = None
+    token_refresh_margin: float = Field(
+        default=300.0, ge=0,
+        description="Segundos antes de la expiración en los que se renueva el token en segundo plano"
+    )
 
     @model_validator(mode="after")
     def set_authority(self):
@@ -80,6 +103,177 @@ class BusinessCentralConfig(BaseModel):
             )
 
 
+class HttpClientConfig(BaseModel):
+    """
+    Modelo de configuración del transporte HTTP compartido hacia Business Central.
+    Controla el tamaño del pool, el keep-alive y el uso opcional de HTTP/2.
+    """
+    max_connections: int = Field(default=100, ge=1, description="Conexiones simultáneas máximas")
+    max_keepalive_connections: int = Field(default=20, ge=0, description="Conexiones inactivas mantenidas abiertas")
+    keepalive_expiry: float = Field(default=30.0, ge=0, description="Segundos que una conexión inactiva permanece abierta")
+    timeout: float = Field(default=30.0, gt=0, description="Timeout por petición HTTP (segundos)")
+    http2: bool = Field(default=False, description="Habilita multiplexación HTTP/2 (requiere el paquete 'h2')")
+    deadline: float = Field(
+        default=25.0, ge=0,
+        description="Plazo total por llamada a BC incluidos reintentos (segundos, 0 = sin plazo)"
+    )
+    batch_window_ms: float = Field(
+        default=0.0, ge=0,
+        description="Ventana (ms) para agrupar GET concurrentes en un $batch; 0 lo desactiva salvo con batch()"
+    )
+    batch_max_size: int = Field(default=20, ge=1, le=100, description="Peticiones máximas por $batch")
+
+
+class CacheConfig(BaseModel):
+    """
+    Modelo de configuración de la caché de respuestas (lectura con TTL/LRU).
+    """
+    enabled: bool = Field(default=False, description="Activa la caché de lecturas")
+    max_entries: int = Field(default=1000, ge=1, description="Entradas máximas antes de expulsar (LRU)")
+    default_ttl: float = Field(default=60.0, ge=0, description="TTL por defecto (segundos)")
+    ttls: Dict[str, float] = Field(
+        default_factory=lambda: {"items": 600.0, "customers": 120.0, "salesOrders": 15.0},
+        description="TTL por entidad (segundos)"
+    )
+    companies_ttl: float = Field(default=300.0, ge=0, description="TTL de la lista de compañías (segundos)")
+    generation_ttl: float = Field(
+        default=1.0, ge=0, description="Segundos que se reutiliza la generación de una entidad del estado compartido"
+    )
+
+
+class RateLimitConfig(BaseModel):
+    """
+    Modelo de configuración del limitador de tasa compartido por tenant/entorno.
+    """
+    rate: float = Field(default=0.0, ge=0, description="Peticiones por segundo permitidas (0 = sin límite)")
+    burst: int = Field(default=20, ge=1, description="Ráfaga máxima de peticiones")
+
+
+class CircuitBreakerConfig(BaseModel):
+    """
+    Modelo de configuración del circuit breaker por endpoint de Business Central.
+    """
+    failure_threshold: int = Field(default=5, ge=0, description="Fallos consecutivos que abren el circuito (0 = desactivado)")
+    recovery_timeout: float = Field(default=30.0, gt=0, description="Segundos en abierto antes de sondear la recuperación")
+    half_open_max_calls: int = Field(default=1, ge=1, description="Sondas simultáneas permitidas en semiabierto")
+
+
+class ConcurrencyConfig(BaseModel):
+    """
+    Modelo de configuración del limitador adaptativo de concurrencia (AIMD).
+    """
+    enabled: bool = Field(default=False, description="Activa el limitador adaptativo")
+    initial: int = Field(default=10, ge=1, description="Límite inicial de peticiones en vuelo")
+    min_limit: int = Field(default=1, ge=1, description="Límite mínimo")
+    max_limit: int = Field(default=50, ge=1, description="Límite máximo")
+    max_wait: float = Field(default=30.0, gt=0, description="Espera máxima en cola (segundos)")
+    latency_tolerance: float = Field(default=2.0, gt=1, description="Latencia/base a partir de la cual se reduce el límite")
+    backoff: float = Field(default=0.7, gt=0, lt=1, description="Factor multiplicativo de reducción")
+
+
+class HedgingConfig(BaseModel):
+    """
+    Modelo de configuración de las peticiones de cobertura (hedging) en lecturas GET.
+    """
+    enabled: bool = Field(default=False, description="Activa el hedging de lecturas")
+    percentile: float = Field(default=95.0, gt=0, lt=100, description="Percentil de latencia que dispara la cobertura")
+    min_delay: float = Field(default=0.05, ge=0, description="Retardo mínimo antes de cubrir (segundos)")
+    budget_ratio: float = Field(default=0.05, gt=0, le=1, description="Fracción máxima de peticiones extra")
+
+
+class RetryConfig(BaseModel):
+    """
+    Modelo de configuración de la política de reintentos hacia Business Central.
+    """
+    max_attempts: int = Field(default=3, ge=1, description="Intentos máximos por petición (incluido el primero)")
+    base_delay: float = Field(default=1.0, ge=0, description="Base del backoff exponencial (segundos)")
+    max_delay: float = Field(default=8.0, ge=0, description="Tope de espera entre intentos (segundos)")
+    budget_ratio: float = Field(default=0.2, ge=0, description="Reintentos permitidos por petición original")
+    budget_min_per_sec: float = Field(default=1.0, ge=0, description="Reintentos por segundo siempre disponibles")
+
+
+class BulkWriteConfig(BaseModel):
+    """
+    Modelo de configuración de las altas masivas (`create_customers`) vía `$batch`.
+    """
+    changeset_size: int = Field(default=20, ge=1, le=100, description="Registros por petición $batch")
+    concurrency: int = Field(default=4, ge=1, description="Lotes $batch enviados en paralelo")
+    atomic: bool = Field(default=False, description="Cada lote es un changeset atómico (todo o nada)")
+
+
+class IdempotencyConfig(BaseModel):
+    """
+    Modelo de configuración del almacén local de claves de idempotencia de las escrituras.
+    """
+    ttl: float = Field(default=86400.0, gt=0, description="Segundos que se recuerda una escritura completada")
+    max_entries: int = Field(default=10000, ge=1, description="Claves máximas en memoria")
+
+
+class WriteQueueConfig(BaseModel):
+    """
+    Modelo de configuración de la cola local de escrituras diferidas (write-behind).
+    """
+    enabled: bool = Field(default=False, description="Permite crear clientes en segundo plano con ticket")
+    path: str = Field(default=os.path.join(DATA_DIR, "write_queue.db"),
+                      description="Fichero SQLite de la cola (en producción, en disco persistente)")
+    batch_size: int = Field(default=100, ge=1, description="Escrituras enviadas por vaciado")
+    poll_interval: float = Field(default=1.0, gt=0, description="Segundos entre comprobaciones de la cola")
+    max_attempts: int = Field(default=5, ge=1, description="Intentos antes de marcar una escritura como fallida")
+    lease: float = Field(default=300.0, gt=0, description="Segundos que un worker reserva las escrituras que envía")
+
+
+class TokenCacheConfig(BaseModel):
+    """
+    Modelo de configuración de la caché en disco de tokens de Azure AD.
+    """
+    enabled: bool = Field(default=False, description="Reutiliza entre reinicios y workers los tokens aún válidos")
+    path: str = Field(default=os.path.join(DATA_DIR, "token_cache.json"),
+                      description="Fichero de la caché (se crea con permisos 0600)")
+
+
+class SharedStateConfig(BaseModel):
+    """
+    Modelo de configuración del estado compartido entre procesos (workers de uvicorn).
+    """
+    backend: Literal["memory", "sqlite"] = Field(
+        default="memory", description="'memory' = estado por proceso; 'sqlite' = fichero local compartido"
+    )
+    path: str = Field(default=os.path.join(DATA_DIR, "shared_state.db"),
+                      description="Fichero SQLite del estado compartido")
+
+
+class ProfileConfig(BaseModel):
+    """
+    Modelo de un perfil de conexión: credenciales de Azure AD y entorno de Business Central.
+    El perfil 'default' sale de AZURE_* / BC_*; el resto de `BC_PROFILES`.
+    """
+    name: str = Field(..., description="Nombre del perfil (p.ej. 'default', 'sandbox', 'contoso-prod')")
+    azure_ad: AzureADConfig
+    bc: BusinessCentralConfig
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """
+    Interpreta una variable de entorno booleana ('1', 'true', 'yes', 'on').
+    """
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_mapping(name: str) -> Dict[str, float]:
+    """
+    Interpreta una variable de entorno con formato 'clave=valor,clave=valor'.
+    """
+    result: Dict[str, float] = {}
+    for pair in (os.getenv(name) or "").split(","):
+        if "=" in pair:
+            k, v = pair.split("=", 1)
+            result[k.strip()] = float(v)
+    return result
+
+
 class AppConfig:
     """
     Clase principal de configuración de la app MCP.
@@ -88,6 +282,19 @@ class AppConfig:
     def __init__(self):
         self.azure_ad = self._load_azure()
         self.bc = self._load_bc()
+        self.http = self._load_http()
+        self.cache = self._load_cache()
+        self.rate_limit = self._load_rate_limit()
+        self.circuit_breaker = self._load_circuit_breaker()
+        self.concurrency = self._load_concurrency()
+        self.hedging = self._load_hedging()
+        self.retry = self._load_retry()
+        self.bulk = self._load_bulk()
+        self.idempotency = self._load_idempotency()
+        self.write_queue = self._load_write_queue()
+        self.token_cache = self._load_token_cache()
+        self.shared_state = self._load_shared_state()
+        self.profiles = self._load_profiles()
 
     def _load_azure(self) -> AzureADConfig:
         """
@@ -106,7 +313,8 @@ class AppConfig:
                 ("AZURE_CLIENT_SECRET", s),
             ) if not val]
             raise ValueError(f"Faltan variables de Azure AD: {', '.join(missing)}")
-        return AzureADConfig(tenant_id=t, client_id=c, client_secret=s)
+        margin = float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN", "300"))
+        return AzureADConfig(tenant_id=t, client_id=c, client_secret=s, token_refresh_margin=margin)
 
     def _load_bc(self) -> BusinessCentralConfig:
         """
@@ -124,6 +332,172 @@ class AppConfig:
         bc.__post_init__()
         return bc
 
+    def _load_http(self) -> HttpClientConfig:
+        """
+        Carga la configuración del pool HTTP desde variables de entorno (todas opcionales).
+        """
+        return HttpClientConfig(
+            max_connections=int(os.getenv("BC_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("BC_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("BC_HTTP_KEEPALIVE_EXPIRY", "30")),
+            timeout=float(os.getenv("BC_HTTP_TIMEOUT", "30")),
+            http2=_env_bool("BC_HTTP2"),
+            deadline=float(os.getenv("BC_REQUEST_DEADLINE", "25")),
+            batch_window_ms=float(os.getenv("BC_BATCH_WINDOW_MS", "0")),
+            batch_max_size=int(os.getenv("BC_BATCH_MAX_SIZE", "20")),
+        )
+
+    def _load_cache(self) -> CacheConfig:
+        """
+        Carga la configuración de la caché de respuestas desde variables de entorno (opcionales).
+        `BC_CACHE_TTLS` sobrescribe los TTL por entidad por defecto.
+        """
+        cache = CacheConfig(
+            enabled=_env_bool("BC_CACHE_ENABLED"),
+            max_entries=int(os.getenv("BC_CACHE_MAX_ENTRIES", "1000")),
+            default_ttl=float(os.getenv("BC_CACHE_DEFAULT_TTL", "60")),
+            companies_ttl=float(os.getenv("BC_COMPANIES_TTL", "300")),
+            generation_ttl=float(os.getenv("BC_CACHE_GENERATION_TTL", "1.0")),
+        )
+        cache.ttls.update(_env_mapping("BC_CACHE_TTLS"))
+        return cache
+
+    def _load_rate_limit(self) -> RateLimitConfig:
+        """
+        Carga la configuración del limitador de tasa desde variables de entorno (opcionales).
+        """
+        return RateLimitConfig(
+            rate=float(os.getenv("BC_RATE_LIMIT_RPS", "0")),
+            burst=int(os.getenv("BC_RATE_LIMIT_BURST", "20")),
+        )
+
+    def _load_circuit_breaker(self) -> CircuitBreakerConfig:
+        """
+        Carga la configuración del circuit breaker desde variables de entorno (opcionales).
+        """
+        return CircuitBreakerConfig(
+            failure_threshold=int(os.getenv("BC_CB_FAILURE_THRESHOLD", "5")),
+            recovery_timeout=float(os.getenv("BC_CB_RECOVERY_TIMEOUT", "30")),
+            half_open_max_calls=int(os.getenv("BC_CB_HALF_OPEN_CALLS", "1")),
+        )
+
+    def _load_concurrency(self) -> ConcurrencyConfig:
+        """
+        Carga la configuración del limitador adaptativo de concurrencia (variables opcionales).
+        """
+        return ConcurrencyConfig(
+            enabled=_env_bool("BC_CONCURRENCY_ADAPTIVE"),
+            initial=int(os.getenv("BC_CONCURRENCY_INITIAL", "10")),
+            min_limit=int(os.getenv("BC_CONCURRENCY_MIN", "1")),
+            max_limit=int(os.getenv("BC_CONCURRENCY_MAX", "50")),
+            max_wait=float(os.getenv("BC_CONCURRENCY_MAX_WAIT", "30")),
+            latency_tolerance=float(os.getenv("BC_CONCURRENCY_LATENCY_TOLERANCE", "2.0")),
+            backoff=float(os.getenv("BC_CONCURRENCY_BACKOFF", "0.7")),
+        )
+
+    def _load_hedging(self) -> HedgingConfig:
+        """
+        Carga la configuración de hedging desde variables de entorno (opcionales).
+        """
+        return HedgingConfig(
+            enabled=_env_bool("BC_HEDGE_ENABLED"),
+            percentile=float(os.getenv("BC_HEDGE_PERCENTILE", "95")),
+            min_delay=float(os.getenv("BC_HEDGE_MIN_DELAY", "0.05")),
+            budget_ratio=float(os.getenv("BC_HEDGE_BUDGET", "0.05")),
+        )
+
+    def _load_retry(self) -> RetryConfig:
+        """
+        Carga la configuración de reintentos desde variables de entorno (opcionales).
+        """
+        return RetryConfig(
+            max_attempts=int(os.getenv("BC_RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("BC_RETRY_BASE_DELAY", "1.0")),
+            max_delay=float(os.getenv("BC_RETRY_MAX_DELAY", "8.0")),
+            budget_ratio=float(os.getenv("BC_RETRY_BUDGET_RATIO", "0.2")),
+            budget_min_per_sec=float(os.getenv("BC_RETRY_BUDGET_MIN_PER_SEC", "1.0")),
+        )
+
+    def _load_bulk(self) -> BulkWriteConfig:
+        """
+        Carga la configuración de altas masivas desde variables de entorno (opcionales).
+        """
+        return BulkWriteConfig(
+            changeset_size=int(os.getenv("BC_BULK_CHANGESET_SIZE", "20")),
+            concurrency=int(os.getenv("BC_BULK_CONCURRENCY", "4")),
+            atomic=_env_bool("BC_BULK_ATOMIC"),
+        )
+
+    def _load_idempotency(self) -> IdempotencyConfig:
+        """
+        Carga la configuración de idempotencia desde variables de entorno (opcionales).
+        """
+        return IdempotencyConfig(
+            ttl=float(os.getenv("BC_IDEMPOTENCY_TTL", "86400")),
+            max_entries=int(os.getenv("BC_IDEMPOTENCY_MAX_ENTRIES", "10000")),
+        )
+
+    def _load_write_queue(self) -> WriteQueueConfig:
+        """
+        Carga la configuración de la cola de escrituras desde variables de entorno (opcionales).
+        """
+        return WriteQueueConfig(
+            enabled=_env_bool("BC_WRITE_QUEUE_ENABLED"),
+            path=os.getenv("BC_WRITE_QUEUE_PATH", os.path.join(DATA_DIR, "write_queue.db")),
+            batch_size=int(os.getenv("BC_WRITE_QUEUE_BATCH_SIZE", "100")),
+            poll_interval=float(os.getenv("BC_WRITE_QUEUE_POLL_INTERVAL", "1.0")),
+            max_attempts=int(os.getenv("BC_WRITE_QUEUE_MAX_ATTEMPTS", "5")),
+            lease=float(os.getenv("BC_WRITE_QUEUE_LEASE", "300")),
+        )
+
+    def _load_token_cache(self) -> TokenCacheConfig:
+        """
+        Carga la configuración de la caché de tokens en disco desde variables de entorno (opcionales).
+        """
+        return TokenCacheConfig(
+            enabled=_env_bool("AZURE_TOKEN_CACHE_ENABLED"),
+            path=os.getenv("AZURE_TOKEN_CACHE_PATH", os.path.join(DATA_DIR, "token_cache.json")),
+        )
+
+    def _load_shared_state(self) -> SharedStateConfig:
+        """
+        Carga la configuración del estado compartido desde variables de entorno (opcionales).
+        """
+        return SharedStateConfig(
+            backend=os.getenv("BC_SHARED_STATE", "memory").strip().lower(),
+            path=os.getenv("BC_SHARED_STATE_PATH", os.path.join(DATA_DIR, "shared_state.db")),
+        )
+
+    def _load_profiles(self) -> Dict[str, ProfileConfig]:
+        """
+        Carga los perfiles de conexión. 'default' usa la configuración principal; cada nombre
+        de `BC_PROFILES` (separados por comas) se lee de `BC_PROFILE_<NOMBRE>_<CAMPO>`, con
+        NOMBRE en mayúsculas y '-' como '_'. Campos: TENANT_ID, CLIENT_ID, CLIENT_SECRET,
+        ENVIRONMENT y COMPANY_ID; los que falten se toman del perfil 'default'.
+        Ejemplo: BC_PROFILES=sandbox y BC_PROFILE_SANDBOX_ENVIRONMENT=sandbox.
+        """
+        profiles = {"default": ProfileConfig(name="default", azure_ad=self.azure_ad, bc=self.bc)}
+        for name in (os.getenv("BC_PROFILES") or "").split(","):
+            name = name.strip()
+            if not name or name == "default":
+                continue
+            prefix = "BC_PROFILE_" + "".join(ch if ch.isalnum() else "_" for ch in name.upper()) + "_"
+            tenant = os.getenv(prefix + "TENANT_ID", self.azure_ad.tenant_id)
+            azure = AzureADConfig(
+                tenant_id=tenant,
+                client_id=os.getenv(prefix + "CLIENT_ID", self.azure_ad.client_id),
+                client_secret=os.getenv(prefix + "CLIENT_SECRET", self.azure_ad.client_secret),
+                token_refresh_margin=self.azure_ad.token_refresh_margin,
+            )
+            bc = BusinessCentralConfig(
+                environment=os.getenv(prefix + "ENVIRONMENT", self.bc.environment),
+                company_id=os.getenv(prefix + "COMPANY_ID", self.bc.company_id),
+                tenant_id=tenant,
+            )
+            bc.__post_init__()
+            profiles[name] = ProfileConfig(name=name, azure_ad=azure, bc=bc)
+        return profiles
+
     def validate(self) -> bool:
         """
         Valida que la configuración cargada sea consistente y completa.
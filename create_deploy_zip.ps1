@@ -2,7 +2,7 @@
 # Excluye carpetas y archivos innecesarios (como .venv, bc_server_bkp, copilot-studio-connector, etc.)
 
 $zipName = "deploy.zip"
-$exclude = @( ".venv", "bc_server_bkp", "copilot-studio-connector", $zipName )
+$exclude = @( ".venv", "bc_server_bkp", "copilot-studio-connector", $zipName, "write_queue.db", "token_cache.json", "shared_state.db" )
 
 # Elimina el ZIP anterior si existe
 if (Test-Path $zipName) {
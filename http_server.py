@@ -6,7 +6,8 @@ Servidor MCP para Microsoft Dynamics 365 Business Central usando el SDK oficial
 Características principales:
   - Expone herramientas MCP nativas vía HTTP/ASGI (streamable y REST).
   - Soporta transporte Streamable HTTP (recomendado para producción), endpoints REST y protocolo MCP completo (SSE, JSON-RPC).
-  - Métodos disponibles: get_customers, get_customer_details, get_items, get_sales_orders, create_customer.
+  - Métodos disponibles: get_customers, get_customer_details, get_items, get_sales_orders, create_customer,
+    create_customers, get_write_status.
 
 Onboarding rápido:
   1. Configura el archivo `.env` y valida la conexión con Business Central.
@@ -37,7 +38,16 @@ if os.path.exists(env_path):
 #from mcp.server.fastmcp import FastMCP, Context
 from config import config
 from client import bc_client
+from odata import ODataQuery
+from models import to_dicts
+from resilience import deadline_scope
+from azure_auth import aclose_token_managers
+from write_queue import write_queue
+from shared_state import shared_store
+from jsoncodec import BACKEND as JSON_BACKEND, serialize_tool_result
 from fastmcp import FastMCP, Context
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 
 # Configuración global de logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -69,10 +79,20 @@ async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
         logger.error("Configuración inválida - revisar variables de entorno")
         raise RuntimeError("Configuración inválida")
     logger.info("Configuración validada correctamente")
+    logger.info(f"Backend JSON: {JSON_BACKEND}")
+    # Abrir el pool HTTP persistente hacia Business Central
+    await bc_client.open()
+    # Worker de la cola de escrituras diferidas (si está activada)
+    if write_queue is not None:
+        await write_queue.start(bc_client)
     try:
         yield AppContext(initialized=True)
     finally:
         logger.info("Cerrando servidor MCP Business Central...")
+        if write_queue is not None:
+            await write_queue.stop()
+        await bc_client.aclose()
+        await aclose_token_managers()
 
 
 
@@ -81,11 +101,31 @@ mcp = FastMCP(
     name="BusinessCentral",
     lifespan=app_lifespan,
     stateless_http=True,  # Sin persistencia de sesión
+    tool_serializer=serialize_tool_result,  # Resultados de herramientas con el códec JSON rápido
     dependencies=["httpx", "pydantic", "python-dotenv"]
 )
 
 
 logger.info("Servidor MCP Business Central inicializado con SDK oficial")
+
+# =============================================================================
+# HEALTH CHECK
+# =============================================================================
+
+@mcp.custom_route("/health", methods=["GET"])
+async def health(request: Request) -> JSONResponse:
+    """
+    Estado del servidor y métricas del cliente de Business Central
+    (caché, limitador de tasa y estado de los circuit breakers).
+    """
+    return JSONResponse({
+        "status": "degraded" if bc_client.degraded() else "ok",
+        "business_central": bc_client.stats(),
+        "write_queue": write_queue.stats() if write_queue is not None else None,
+        "shared_state": shared_store.stats(),
+    })
+
+
 # =============================================================================
 # EXPOSICIÓN ASGI PARA UVICORN - VERSIÓN OFICIAL
 # =============================================================================
@@ -103,71 +143,147 @@ app = mcp.http_app()
 # =============================================================================
 
 
+def _tool_deadline(ctx: Optional[Context]) -> Optional[float]:
+    """
+    Plazo (segundos) que el cliente MCP solicita en `_meta.timeoutMs`, si lo envía.
+    Sin él se aplica el plazo por defecto del cliente BC (`BC_REQUEST_DEADLINE`).
+    """
+    try:
+        meta = ctx.request_context.meta if ctx else None
+    except (AttributeError, ValueError):
+        return None
+    timeout_ms = getattr(meta, "timeoutMs", None) if meta else None
+    try:
+        return float(timeout_ms) / 1000 if timeout_ms else None
+    except (TypeError, ValueError):
+        return None
+
+
 @mcp.tool()
-async def get_customers(limit: int = 10) -> list[dict]:
+async def get_customers(
+    limit: int = 10,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> list[dict]:
     """
     Lista clientes de Business Central.
     Parámetros:
         limit (int): Número máximo de clientes a retornar (1-100)
+        fields (str): Campos a devolver separados por comas, ej: "number,displayName" (opcional)
+        filter (str): Filtro OData, ej: "city eq 'Madrid'" (opcional)
+        order (str): Ordenación OData, ej: "displayName desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
     Retorna:
         Lista de clientes con información básica.
     """
     if limit < 1 or limit > 100:
         raise ValueError("El límite debe estar entre 1 y 100")
     logger.info(f"Obteniendo {limit} clientes de Business Central")
-    data = await bc_client.get_customers(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        data = await client.get_customers(top=limit, query=query)
     logger.info(f"Clientes obtenidos: {len(data)}")
-    return data
+    return to_dicts(data)
 
 
 @mcp.tool()
-async def get_customer_details(customer_id: str) -> dict:
+async def get_customer_details(
+    customer_id: str,
+    fields: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> dict:
     """
     Obtiene detalles completos de un cliente específico.
     Parámetros:
         customer_id (str): ID único del cliente en Business Central
+        fields (str): Campos a devolver separados por comas (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
     Retorna:
         Información detallada del cliente.
     """
     logger.info(f"Obteniendo detalles del cliente: {customer_id}")
-    result = await bc_client.get_customer(customer_id)
+    query = ODataQuery.from_tool_args(fields)
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        result = await client.get_customer(customer_id, query=query)
     if not result:
         raise ValueError(f"Cliente {customer_id} no encontrado")
-    return result
+    return result.to_dict()
 
 
 @mcp.tool()
-async def get_items(limit: int = 10) -> list[dict]:
+async def get_items(
+    limit: int = 10,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> list[dict]:
     """
     Lista artículos/productos disponibles en Business Central.
     Parámetros:
         limit (int): Número máximo de artículos a retornar (1-100)
+        fields (str): Campos a devolver separados por comas, ej: "number,displayName,unitPrice" (opcional)
+        filter (str): Filtro OData, ej: "unitPrice gt 100" (opcional)
+        order (str): Ordenación OData, ej: "displayName desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
     Retorna:
         Lista de artículos con información básica.
     """
     if limit < 1 or limit > 100:
         raise ValueError("El límite debe estar entre 1 y 100")
     logger.info(f"Obteniendo {limit} artículos de Business Central")
-    data = await bc_client.get_items(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        data = await client.get_items(top=limit, query=query)
     logger.info(f"Artículos obtenidos: {len(data)}")
-    return data
+    return to_dicts(data)
 
 
 @mcp.tool()
-async def get_sales_orders(limit: int = 5) -> list[dict]:
+async def get_sales_orders(
+    limit: int = 5,
+    fields: Optional[str] = None,
+    filter: Optional[str] = None,
+    order: Optional[str] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> list[dict]:
     """
     Lista órdenes de venta de Business Central.
     Parámetros:
         limit (int): Número máximo de órdenes a retornar (1-100)
+        fields (str): Campos a devolver separados por comas, ej: "number,customerName,totalAmountIncludingTax" (opcional)
+        filter (str): Filtro OData, ej: "status eq 'Open'" (opcional)
+        order (str): Ordenación OData, ej: "orderDate desc" (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
     Retorna:
         Lista de órdenes de venta.
     """
     if limit < 1 or limit > 100:
         raise ValueError("El límite debe estar entre 1 y 100")
     logger.info(f"Obteniendo {limit} órdenes de venta de Business Central")
-    data = await bc_client.get_orders(top=limit)
+    query = ODataQuery.from_tool_args(fields, filter, order)
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        data = await client.get_orders(top=limit, query=query)
     logger.info(f"Órdenes obtenidas: {len(data)}")
-    return data
+    return to_dicts(data)
 
 
 @mcp.tool()
@@ -179,6 +295,10 @@ async def create_customer(
     city: Optional[str] = None,
     country: Optional[str] = None,
     taxRegistrationNumber: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    background: bool = False,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
     ctx: Context = None
 ) -> dict:
     """
@@ -191,6 +311,10 @@ async def create_customer(
         city (str): Ciudad (opcional)
         country (str): País (código de 2 letras, ej: ES, US) (opcional)
         taxRegistrationNumber (str): Número de identificación fiscal (opcional)
+        idempotency_key (str): Clave única de la operación; repetirla no crea un duplicado (opcional)
+        background (bool): Encola la escritura y devuelve un ticket al instante (opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
     Retorna:
         Información del cliente creado.
     """
@@ -221,13 +345,121 @@ async def create_customer(
         customer_payload["address"] = {k: v for k, v in customer_payload["address"].items() if v is not None}
         if not customer_payload["address"]:
             del customer_payload["address"]
-    created_customer = await bc_client.create_customer(customer_payload)
+    if background:
+        if write_queue is None:
+            raise ValueError("La cola de escrituras no está activada (BC_WRITE_QUEUE_ENABLED)")
+        client = await bc_client.select(profile, company)
+        ticket = write_queue.enqueue("customer", customer_payload, ticket=idempotency_key,
+                                     company=client.comp, profile=client.profile.name)
+        logger.info(f"Cliente encolado: {displayName} (ticket {ticket})")
+        return {"ticket": ticket, "status": "pending"}
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        created_customer = await client.create_customer(customer_payload, idempotency_key=idempotency_key)
+    if created_customer is None:
+        raise ValueError("No se pudo crear el cliente en Business Central")
     if ctx:
         await ctx.info(f"Cliente creado exitosamente: {created_customer.get('number', 'N/A')}")
     logger.info(f"Cliente creado: {created_customer.get('number', 'N/A')}")
     return created_customer
 
 
+@mcp.tool()
+async def create_customers(
+    customers: list[dict],
+    changeset_size: Optional[int] = None,
+    company: Optional[str] = None,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> dict:
+    """
+    Crea varios clientes en Business Central en una sola operación (lotes `$batch` en paralelo).
+    Parámetros:
+        customers (list[dict]): Clientes con los campos de la API de BC, ej:
+            [{"displayName": "Empresa A", "email": "a@empresa.com", "city": "Madrid", "country": "ES"}]
+            'displayName' y 'email' son obligatorios en cada cliente.
+        changeset_size (int): Clientes por lote $batch (1-100, opcional)
+        company (str): Compañía por id o nombre; por defecto la de BC_COMPANY_ID (opcional)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
+    Retorna:
+        Resumen {total, created, failed} y un resultado por cliente (index, ok, customer o error).
+    """
+    if not customers:
+        raise ValueError("La lista 'customers' no puede estar vacía")
+    invalid = [i for i, c in enumerate(customers) if not c.get("displayName") or not c.get("email")]
+    if invalid:
+        raise ValueError(f"Los campos 'displayName' y 'email' son obligatorios (clientes {invalid})")
+    if changeset_size is not None and not 1 <= changeset_size <= 100:
+        raise ValueError("changeset_size debe estar entre 1 y 100")
+    payload = [{k: v for k, v in c.items() if v is not None} for c in customers]
+    if ctx:
+        await ctx.info(f"Creando {len(payload)} clientes en lotes $batch")
+    logger.info(f"Alta masiva de {len(payload)} clientes")
+    with deadline_scope(_tool_deadline(ctx)):
+        client = await bc_client.select(profile, company)
+        result = await client.create_customers(payload, changeset_size=changeset_size)
+    logger.info(f"Alta masiva: {result['created']} creados, {result['failed']} fallidos")
+    return result
+
+
+@mcp.tool()
+async def get_write_status(ticket: str) -> dict:
+    """
+    Consulta el estado de una escritura diferida.
+    Parámetros:
+        ticket (str): Ticket devuelto por create_customer(background=True)
+    Retorna:
+        Estado (pending, processing, done, failed), intentos y cliente creado o error.
+    """
+    if write_queue is None:
+        raise ValueError("La cola de escrituras no está activada (BC_WRITE_QUEUE_ENABLED)")
+    status = write_queue.status(ticket)
+    if status is None:
+        raise ValueError(f"Ticket {ticket} no encontrado")
+    return status
+
+
+@mcp.tool()
+async def list_companies(profile: Optional[str] = None, ctx: Context = None) -> list[dict]:
+    """
+    Lista las compañías del entorno de Business Central.
+    Parámetros:
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
+    Retorna:
+        Lista de compañías (id, name, displayName).
+    """
+    with deadline_scope(_tool_deadline(ctx)):
+        companies = await bc_client.for_profile(profile).list_companies()
+    return [{k: c.get(k) for k in ("id", "name", "displayName")} for c in companies]
+
+
+@mcp.tool()
+async def find_customer_all_companies(
+    search: str,
+    limit: int = 5,
+    profile: Optional[str] = None,
+    ctx: Context = None
+) -> list[dict]:
+    """
+    Busca un cliente en todas las compañías en paralelo.
+    Parámetros:
+        search (str): Número exacto, email exacto o texto contenido en el nombre
+        limit (int): Coincidencias máximas por compañía (1-50, por defecto 5)
+        profile (str): Perfil de conexión (tenant/entorno) de BC_PROFILES; por defecto 'default' (opcional)
+    Retorna:
+        Clientes encontrados con 'companyId' y 'companyName' de su compañía.
+    """
+    if not search:
+        raise ValueError("El parámetro 'search' no puede estar vacío")
+    if not 1 <= limit <= 50:
+        raise ValueError("El límite debe estar entre 1 y 50")
+    logger.info(f"Buscando '{search}' en todas las compañías")
+    with deadline_scope(_tool_deadline(ctx)):
+        data = await bc_client.for_profile(profile).find_customers_all_companies(search, top=limit)
+    logger.info(f"Coincidencias en todas las compañías: {len(data)}")
+    return data
+
+
 
 
 # =============================================================================
@@ -0,0 +1,123 @@
+"""
+idempotency.py
+
+Almacén local de claves de idempotencia para las escrituras en Business Central.
+
+Características principales:
+  - Cada escritura lleva una clave (la aporta el llamador o se genera). Si la misma clave
+    se repite dentro del TTL se devuelve el resultado guardado sin volver a llamar a BC.
+  - Dos llamadas concurrentes con la misma clave comparten una única ejecución.
+  - Solo se guardan los resultados correctos: un fallo libera la clave para poder reintentar,
+    pero se recuerda (`attempted()`) para comprobar si el intento fallido llegó a aplicarse.
+  - Acotado por número de entradas (se descartan primero las más antiguas).
+
+Ejemplo:
+    result = await store.run(key, lambda: bc_client._request("POST", "customers", data=payload))
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyStore:
+    """
+    Registro en memoria clave -> resultado con caducidad. Seguro dentro de un event loop.
+    """
+    def __init__(self, ttl: float = 86400.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # clave -> (expiración monotónica, resultado)
+        self._done: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # clave -> expiración monotónica de las ejecuciones terminadas sin resultado
+        self._attempted: "OrderedDict[str, float]" = OrderedDict()
+        # Métricas
+        self.replays = 0
+        self.stored = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Devuelve el resultado guardado para `key` o None si no existe o ha caducado.
+        """
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            del self._done[key]
+            return None
+        return entry[1]
+
+    def attempted(self, key: str) -> bool:
+        """
+        Indica si `key` ya se ejecutó sin resultado dentro del TTL: la escritura pudo haberse
+        aplicado en BC aunque el llamador recibiera un fallo.
+        """
+        expires = self._attempted.get(key)
+        if expires is None:
+            return False
+        if time.monotonic() >= expires:
+            del self._attempted[key]
+            return False
+        return True
+
+    def _failed(self, key: str) -> None:
+        self._attempted[key] = time.monotonic() + self.ttl
+        self._attempted.move_to_end(key)
+        while len(self._attempted) > self.max_entries:
+            self._attempted.popitem(last=False)
+
+    def put(self, key: str, result: Any) -> None:
+        """
+        Guarda el resultado de una escritura correcta.
+        """
+        self._done[key] = (time.monotonic() + self.ttl, result)
+        self._done.move_to_end(key)
+        self.stored += 1
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    async def run(self, key: str, operation: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """
+        Ejecuta `operation` una sola vez por clave: devuelve el resultado guardado si ya se
+        completó, espera a la ejecución en curso si la hay y, si no, la lanza y guarda el
+        resultado cuando no es None.
+        """
+        stored = self.get(key)
+        if stored is not None:
+            self.replays += 1
+            return stored
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.replays += 1
+            return await asyncio.shield(pending)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            self._failed(key)
+            fut.cancel()
+            raise
+        except BaseException as e:
+            self._failed(key)
+            fut.set_exception(e)
+            # Evita el aviso de excepción no recuperada si nadie más esperaba
+            fut.exception()
+            raise
+        else:
+            if result is not None:
+                self.put(key, result)
+            else:
+                self._failed(key)
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve las métricas del almacén.
+        """
+        return {"entries": len(self._done), "in_flight": len(self._inflight), "attempted": len(self._attempted),
+                "stored": self.stored, "replays": self.replays}
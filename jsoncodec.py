@@ -0,0 +1,91 @@
+"""
+jsoncodec.py
+
+Códec JSON del proyecto con backend rápido opcional.
+
+Características principales:
+  - Usa `orjson` si está instalado (decodificación y codificación en Rust, varias veces más
+    rápida que `json` con listas grandes de clientes u órdenes) y `json` de la librería
+    estándar en caso contrario.
+  - El backend se elige una sola vez al arrancar; `BC_JSON_BACKEND` permite forzarlo
+    (`auto`, `orjson` o `json`).
+  - Lo usan `BusinessCentralClient` (cuerpos de respuesta y de petición) y los servidores
+    MCP para serializar los resultados de las herramientas (`serialize_tool_result`).
+
+Onboarding rápido:
+  1. `pip install orjson` (opcional) y reinicia el servidor.
+  2. Comprueba el backend activo en los logs de arranque o con `jsoncodec.BACKEND`.
+  3. Compara ambos backends con `python bench_json.py`.
+"""
+import json
+import logging
+import os
+from typing import Any, Union
+
+logger = logging.getLogger("jsoncodec")
+
+_requested = os.getenv("BC_JSON_BACKEND", "auto").strip().lower()
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+if _requested not in ("auto", "orjson", "json"):
+    logger.warning(f"BC_JSON_BACKEND='{_requested}' no reconocido, se usa 'auto'.")
+    _requested = "auto"
+if _requested == "orjson" and orjson is None:
+    logger.warning("BC_JSON_BACKEND=orjson pero 'orjson' no está instalado, se usa 'json'.")
+
+# Backend activo: 'orjson' o 'json'
+BACKEND = "orjson" if orjson is not None and _requested != "json" else "json"
+
+
+def _default(obj: Any) -> Any:
+    """
+    Conversión de tipos no nativos: registros de `models` vía `to_dict()`, el resto con `str`.
+    """
+    to_dict = getattr(obj, "to_dict", None)
+    return to_dict() if callable(to_dict) else str(obj)
+
+
+if BACKEND == "orjson":
+    def loads(data: Union[bytes, str]) -> Any:
+        """
+        Decodifica un documento JSON (bytes o str).
+        """
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        """
+        Codifica un objeto a JSON compacto en UTF-8. Los tipos no serializables se
+        convierten con `to_dict()` (registros) o `str` (fechas, Decimal, ...).
+        """
+        return orjson.dumps(obj, default=_default)
+
+    def serialize_tool_result(obj: Any) -> str:
+        """
+        Serializa el resultado de una herramienta MCP como texto JSON indentado
+        (mismo formato que el serializador por defecto de FastMCP).
+        """
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_INDENT_2).decode()
+else:
+    def loads(data: Union[bytes, str]) -> Any:
+        """
+        Decodifica un documento JSON (bytes o str).
+        """
+        return json.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        """
+        Codifica un objeto a JSON compacto en UTF-8. Los tipos no serializables se
+        convierten con `to_dict()` (registros) o `str` (fechas, Decimal, ...).
+        """
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def serialize_tool_result(obj: Any) -> str:
+        """
+        Serializa el resultado de una herramienta MCP como texto JSON indentado
+        (mismo formato que el serializador por defecto de FastMCP).
+        """
+        return json.dumps(obj, default=_default, ensure_ascii=False, indent=2)
@@ -0,0 +1,160 @@
+"""
+jsonstream.py
+
+Decodificación incremental de respuestas de colección OData de Business Central.
+
+Características principales:
+  - `ODataStreamParser` recibe el cuerpo de la respuesta por trozos (`aiter_bytes()`) y
+    devuelve los registros del array `value` en cuanto están completos.
+  - La memoria máxima depende del tamaño de un registro y del trozo de red, no del tamaño
+    de la página: no se materializan a la vez los bytes, el texto y el diccionario completos.
+  - El resto de claves de primer nivel (`@odata.nextLink`, `@odata.count`, ...) quedan en
+    `parser.meta`, estén antes o después del array.
+
+Ejemplo:
+    parser = ODataStreamParser()
+    async for chunk in resp.aiter_bytes():
+        for record in parser.feed(chunk):
+            ...
+    for record in parser.close():
+        ...
+    next_link = parser.meta.get("@odata.nextLink")
+"""
+import codecs
+import json
+from typing import Any, Dict, List
+
+_WHITESPACE = " \t\n\r"
+
+# Caracteres que pueden seguir a un número completo
+_NUMBER_END = _WHITESPACE + ",}]"
+
+# Estados del analizador
+_START, _KEY, _COLON, _VALUE, _ARRAY, _END = range(6)
+
+
+class ODataStreamParser:
+    """
+    Analizador incremental de un objeto JSON `{"...": ..., "value": [ {...}, ... ]}`.
+    Cada elemento del array se decodifica con `json.JSONDecoder.raw_decode` en cuanto el
+    búfer lo contiene entero; los datos ya consumidos se descartan.
+    """
+    def __init__(self, array_key: str = "value"):
+        self.array_key = array_key
+        self.meta: Dict[str, Any] = {}
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._state = _START
+        self._key = ""
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        Añade un trozo del cuerpo y devuelve los registros completados con él.
+        """
+        self._buf += self._utf8.decode(chunk)
+        return self._parse(final=False)
+
+    def close(self) -> List[Any]:
+        """
+        Señala el fin del cuerpo. Devuelve los registros pendientes y lanza
+        `json.JSONDecodeError` si la respuesta estaba truncada o mal formada.
+        """
+        self._buf += self._utf8.decode(b"", final=True)
+        items = self._parse(final=True)
+        if self._state != _END or self._buf.strip():
+            raise json.JSONDecodeError("Respuesta JSON incompleta", self._buf, 0)
+        return items
+
+    def _skip(self, pos: int, separators: str = "") -> int:
+        buf = self._buf
+        while pos < len(buf) and (buf[pos] in _WHITESPACE or buf[pos] in separators):
+            pos += 1
+        return pos
+
+    def _decode(self, pos: int, final: bool):
+        """
+        Decodifica un valor JSON en `pos`. Retorna (valor, fin) o None si faltan datos.
+        Un valor que termina justo al final del búfer solo se acepta con `final`, porque
+        un número como `12` podría continuar en el siguiente trozo; tampoco un número seguido
+        de algo que no sea un separador (`-2500.` puede seguir como `-2500.0`).
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buf, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        if not final:
+            if end >= len(self._buf):
+                return None
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and self._buf[end] not in _NUMBER_END:
+                return None
+        return value, end
+
+    def _parse(self, final: bool) -> List[Any]:
+        items: List[Any] = []
+        pos = 0
+        buf = self._buf
+        while True:
+            if self._state == _START:
+                pos = self._skip(pos)
+                if pos >= len(buf):
+                    break
+                if buf[pos] != "{":
+                    raise json.JSONDecodeError("Se esperaba un objeto JSON", buf, pos)
+                pos += 1
+                self._state = _KEY
+            elif self._state == _KEY:
+                pos = self._skip(pos, ",")
+                if pos >= len(buf):
+                    break
+                if buf[pos] == "}":
+                    pos += 1
+                    self._state = _END
+                    continue
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    break
+                self._key, pos = decoded
+                self._state = _COLON
+            elif self._state == _COLON:
+                pos = self._skip(pos)
+                if pos >= len(buf):
+                    break
+                if buf[pos] != ":":
+                    raise json.JSONDecodeError("Se esperaba ':'", buf, pos)
+                pos += 1
+                self._state = _VALUE
+            elif self._state == _VALUE:
+                pos = self._skip(pos)
+                if pos >= len(buf):
+                    break
+                if self._key == self.array_key and buf[pos] == "[":
+                    pos += 1
+                    self._state = _ARRAY
+                    continue
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    break
+                self.meta[self._key], pos = decoded
+                self._state = _KEY
+            elif self._state == _ARRAY:
+                pos = self._skip(pos, ",")
+                if pos >= len(buf):
+                    break
+                if buf[pos] == "]":
+                    pos += 1
+                    self._state = _KEY
+                    continue
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    break
+                item, pos = decoded
+                items.append(item)
+            else:
+                break
+        # Descartar lo ya consumido: el búfer solo retiene el registro en curso
+        self._buf = buf[pos:]
+        return items
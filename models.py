@@ -0,0 +1,195 @@
+"""
+models.py
+
+Registros compactos y tipados para las entidades de Business Central.
+
+Características principales:
+  - `Customer`, `Item` y `SalesOrder` usan `__slots__`: sin `__dict__` por instancia, de
+    modo que una página cacheada ocupa una fracción de la memoria de los diccionarios de BC.
+  - Se descartan las anotaciones OData (`@odata.context`, `...@odata.mediaReadLink`) salvo
+    `@odata.etag`, necesaria para revalidar la caché con `If-None-Match`.
+  - Los campos no declarados (navegaciones de `$expand`, campos de extensiones) se conservan
+    en un diccionario aparte que solo existe si hay alguno.
+  - Los campos ausentes (p.ej. por `$select`) no ocupan valor y no aparecen en la salida.
+  - Se comportan como un `Mapping` de solo lectura (`rec["number"]`, `rec.get("email")`) y se
+    convierten a `dict` solo al devolverlos: `rec.to_dict()` o `to_dicts(records)`.
+
+Ejemplo:
+    customers = await bc_client.get_customers(top=100)
+    customers[0].displayName
+    return to_dicts(customers)
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Type
+
+_MISSING = object()
+
+_ETAG = "@odata.etag"
+
+
+class BCRecord(Mapping):
+    """
+    Base de los registros de Business Central. Las subclases declaran sus campos con
+    `__slots__ = FIELDS = (...)` usando los nombres de la API v2.0.
+    """
+    __slots__ = ("etag", "_extra")
+    FIELDS: tuple = ()
+    _FIELD_SET: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BCRecord":
+        """
+        Construye un registro a partir del JSON de BC, descartando anotaciones OData.
+        """
+        obj = cls.__new__(cls)
+        fields = cls._FIELD_SET
+        extra: Optional[Dict[str, Any]] = None
+        for key, value in data.items():
+            if key in fields:
+                setattr(obj, key, value)
+            elif key == _ETAG:
+                obj.etag = value
+            elif "@odata." in key:
+                continue
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        obj._extra = extra
+        return obj
+
+    @classmethod
+    def from_list(cls, rows: Iterable[Dict[str, Any]]) -> List["BCRecord"]:
+        """
+        Convierte una lista de diccionarios de BC en registros.
+        """
+        return [cls.from_dict(r) for r in rows]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Devuelve el registro como diccionario JSON (mismo formato que la API, sin
+        anotaciones salvo `@odata.etag`).
+        """
+        out: Dict[str, Any] = {}
+        etag = getattr(self, "etag", _MISSING)
+        if etag is not _MISSING:
+            out[_ETAG] = etag
+        for name in self.FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                out[name] = value
+        if self._extra:
+            out.update(self._extra)
+        return out
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELD_SET or key == _ETAG:
+            value = getattr(self, "etag" if key == _ETAG else key, _MISSING)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        if getattr(self, "etag", _MISSING) is not _MISSING:
+            yield _ETAG
+        for name in self.FIELDS:
+            if getattr(self, name, _MISSING) is not _MISSING:
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        key = getattr(self, "number", None) or getattr(self, "id", None)
+        return f"{type(self).__name__}({key!r})"
+
+
+class Customer(BCRecord):
+    """
+    Cliente (`customers`).
+    """
+    __slots__ = FIELDS = (
+        "id", "number", "displayName", "type", "addressLine1", "addressLine2", "city",
+        "state", "country", "postalCode", "phoneNumber", "email", "website",
+        "salespersonCode", "balanceDue", "creditLimit", "taxLiable", "taxAreaId",
+        "taxAreaDisplayName", "taxRegistrationNumber", "currencyId", "currencyCode",
+        "paymentTermsId", "shipmentMethodId", "paymentMethodId", "blocked",
+        "lastModifiedDateTime",
+    )
+
+
+class Item(BCRecord):
+    """
+    Artículo (`items`).
+    """
+    __slots__ = FIELDS = (
+        "id", "number", "displayName", "displayName2", "type", "itemCategoryId",
+        "itemCategoryCode", "blocked", "gtin", "inventory", "unitPrice", "priceIncludesTax",
+        "unitCost", "taxGroupId", "taxGroupCode", "baseUnitOfMeasureId",
+        "baseUnitOfMeasureCode", "generalProductPostingGroupId",
+        "generalProductPostingGroupCode", "inventoryPostingGroupId",
+        "inventoryPostingGroupCode", "lastModifiedDateTime",
+    )
+
+
+class SalesOrder(BCRecord):
+    """
+    Orden de venta (`salesOrders`).
+    """
+    __slots__ = FIELDS = (
+        "id", "number", "externalDocumentNumber", "orderDate", "postingDate", "customerId",
+        "customerNumber", "customerName", "billToName", "billToCustomerId",
+        "billToCustomerNumber", "shipToName", "shipToContact", "sellToAddressLine1",
+        "sellToAddressLine2", "sellToCity", "sellToCountry", "sellToState", "sellToPostCode",
+        "billToAddressLine1", "billToAddressLine2", "billToCity", "billToCountry",
+        "billToState", "billToPostCode", "shipToAddressLine1", "shipToAddressLine2",
+        "shipToCity", "shipToCountry", "shipToState", "shipToPostCode", "shortcutDimension1Code",
+        "shortcutDimension2Code", "currencyId", "currencyCode", "pricesIncludeTax",
+        "paymentTermsId", "shipmentMethodId", "salesperson", "partialShipping",
+        "requestedDeliveryDate", "discountAmount", "discountAppliedBeforeTax",
+        "totalAmountExcludingTax", "totalTaxAmount", "totalAmountIncludingTax",
+        "fullyShipped", "status", "lastModifiedDateTime", "phoneNumber", "email",
+    )
+
+
+# Entidad de la API -> tipo de registro
+MODELS: Dict[str, Type[BCRecord]] = {
+    "customers": Customer,
+    "items": Item,
+    "salesOrders": SalesOrder,
+}
+
+
+def to_records(entity: str, result: Any) -> Any:
+    """
+    Convierte la respuesta JSON de un GET a registros si la entidad tiene modelo:
+    las colecciones (`value`) pasan a lista de registros y las entidades sueltas a registro.
+    Cualquier otra respuesta ($count, entidades sin modelo) se devuelve sin cambios.
+    """
+    model = MODELS.get(entity)
+    if model is None or not isinstance(result, dict):
+        return result
+    if "value" in result:
+        if not isinstance(result["value"], list):
+            return result
+        converted = {k: v for k, v in result.items() if k != "@odata.context"}
+        converted["value"] = model.from_list(result["value"])
+        return converted
+    return model.from_dict(result)
+
+
+def to_dicts(records: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Convierte registros a diccionarios para la salida de las herramientas MCP.
+    Los elementos que ya son diccionarios se devuelven tal cual.
+    """
+    return [r.to_dict() if isinstance(r, BCRecord) else r for r in records]
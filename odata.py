@@ -0,0 +1,97 @@
+"""
+odata.py
+
+Constructor tipado de consultas OData para la API de Business Central.
+
+Características principales:
+  - `ODataQuery` agrupa las opciones de consulta del sistema ($select, $filter, $orderby,
+    $expand, $top, $skip) y las traduce a parámetros de query con `to_params()`.
+  - Permite que Business Central filtre y proyecte en servidor, reduciendo el tamaño de la
+    respuesta y los tokens que recibe el agente.
+  - `from_tool_args()` convierte los parámetros sencillos de las herramientas MCP
+    (fields, filter, order) en una consulta.
+
+Ejemplo:
+    q = ODataQuery(select=["number", "displayName"], filter="city eq 'Madrid'", orderby=["displayName"])
+    await bc_client.get_customers(top=10, query=q)
+
+Referencias útiles:
+  - Parámetros OData en Business Central: https://learn.microsoft.com/en-us/dynamics365/business-central/dev-itpro/webservices/use-filtering-in-web-services
+  - Blog TechSphereDynamics: https://techspheredynamics.com
+"""
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+
+def _split_csv(value: Optional[str]) -> List[str]:
+    """
+    Divide una lista separada por comas descartando espacios y elementos vacíos.
+    """
+    if not value:
+        return []
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+@dataclass(frozen=True)
+class ODataQuery:
+    """
+    Opciones de consulta OData para una petición de lectura.
+    Todos los campos son opcionales; solo se envían los que tienen valor.
+    """
+    select: List[str] = field(default_factory=list)
+    filter: Optional[str] = None
+    orderby: List[str] = field(default_factory=list)
+    expand: List[str] = field(default_factory=list)
+    top: Optional[int] = None
+    skip: Optional[int] = None
+
+    @classmethod
+    def from_tool_args(
+        cls,
+        fields: Optional[str] = None,
+        filter: Optional[str] = None,
+        order: Optional[str] = None,
+        expand: Optional[str] = None
+    ) -> Optional["ODataQuery"]:
+        """
+        Construye una consulta a partir de los parámetros de texto de las herramientas MCP.
+        Parámetros:
+            fields (str): Campos separados por comas, p.ej. "number,displayName,email"
+            filter (str): Expresión OData, p.ej. "city eq 'Madrid'"
+            order (str): Ordenación separada por comas, p.ej. "displayName desc"
+            expand (str): Navegaciones a expandir separadas por comas
+        Retorna:
+            ODataQuery o None si no se indicó ninguna opción.
+        """
+        query = cls(
+            select=_split_csv(fields),
+            filter=filter.strip() if filter and filter.strip() else None,
+            orderby=_split_csv(order),
+            expand=_split_csv(expand),
+        )
+        return query if query.to_params() else None
+
+    def with_page(self, top: Optional[int] = None, skip: Optional[int] = None) -> "ODataQuery":
+        """
+        Devuelve una copia con `$top`/`$skip` fijados (útil para paginar una consulta base).
+        """
+        return replace(self, top=top, skip=skip)
+
+    def to_params(self) -> Dict[str, Any]:
+        """
+        Traduce la consulta a parámetros de query OData listos para httpx.
+        """
+        params: Dict[str, Any] = {}
+        if self.select:
+            params["$select"] = ",".join(self.select)
+        if self.filter:
+            params["$filter"] = self.filter
+        if self.orderby:
+            params["$orderby"] = ",".join(self.orderby)
+        if self.expand:
+            params["$expand"] = ",".join(self.expand)
+        if self.top is not None:
+            params["$top"] = self.top
+        if self.skip is not None:
+            params["$skip"] = self.skip
+        return params
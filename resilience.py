@@ -0,0 +1,573 @@
+"""
+resilience.py
+
+Primitivas de resiliencia para las llamadas salientes a Business Central.
+
+Características principales:
+  - `TokenBucket`: limitador de tasa (peticiones/segundo con ráfaga) compartido por todas
+    las llamadas a un mismo tenant/entorno, con pausa global ante `Retry-After` (429).
+  - `rate_limiter_for()`: registro de limitadores por tenant/entorno.
+  - `parse_retry_after()`: interpreta la cabecera `Retry-After` (segundos o fecha HTTP).
+  - `CircuitBreaker`: cortocircuito por endpoint (cerrado/abierto/semiabierto) para fallar
+    rápido mientras BC no responde y sondear su recuperación tras un tiempo de espera.
+  - `AdaptiveConcurrencyLimiter`: límite AIMD de peticiones en vuelo que crece mientras la
+    latencia es estable y se reduce ante 429, 5xx o latencia creciente respecto a la base
+    del mismo tipo de petición (una lista no se compara con la lectura de una entidad).
+  - `HedgingPolicy`: decide cuándo lanzar una petición de cobertura (hedge) para lecturas
+    idempotentes, según un percentil de latencia observado y un presupuesto de carga extra.
+  - `RetryPolicy` / `RetryBudget`: política de reintentos enchufable con backoff exponencial
+    y jitter completo, reglas por método (seguros vs. no idempotentes) y un presupuesto de
+    reintentos global que evita multiplicar la carga durante una caída.
+  - `deadline_scope()` / `time_remaining()`: plazo extremo a extremo de una llamada de
+    herramienta, propagado vía ContextVar a reintentos, esperas y obtención de token.
+
+Referencias útiles:
+  - Límites de la API de Business Central: https://learn.microsoft.com/en-us/dynamics365/business-central/dev-itpro/api-reference/v2.0/dynamics-rate-limits
+  - Blog TechSphereDynamics: https://techspheredynamics.com
+"""
+import asyncio
+import httpx
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+
+# Instante (reloj monotónico) en que vence el plazo de la llamada en curso
+_deadline: ContextVar[Optional[float]] = ContextVar("bc_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Fija un plazo de `seconds` segundos para todo lo que se ejecute dentro del bloque
+    (incluidas las tareas creadas en él). Un plazo exterior más estricto se respeta;
+    con `seconds=None` el bloque no cambia nada.
+    """
+    if seconds is None:
+        yield
+        return
+    new = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    """
+    Segundos que quedan hasta el plazo activo (0 si ya venció) o None si no hay plazo.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Convierte la cabecera `Retry-After` en segundos de espera.
+    Acepta un número de segundos o una fecha HTTP; devuelve None si no es interpretable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Limitador de tasa token-bucket para asyncio.
+    Cada llamada consume un token; los tokens se reponen a `rate` por segundo hasta `burst`.
+    Los llamadores que exceden la tasa esperan en orden de llegada.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        # Métricas
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self.rejected = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int = 1, timeout: Optional[float] = None) -> Optional[float]:
+        """
+        Espera hasta disponer de `tokens` tokens (p.ej. uno por operación de un `$batch`).
+        Retorna los segundos esperados, o None sin consumir nada si la espera (incluida una
+        pausa por Retry-After) superaría `timeout` segundos.
+        """
+        tokens = max(1, tokens)
+        # El cubo nunca pasa de la ráfaga: un lote mayor espera a tenerlo lleno y, además, a
+        # que se repongan los tokens que le faltan, de modo que se cobra entero
+        need = min(tokens, self.burst)
+        deficit = (tokens - need) / self.rate
+        started = time.monotonic()
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= need:
+                        delay = 0.0
+                    else:
+                        delay = (need - self._tokens) / self.rate
+                if timeout is not None and now - started + delay + deficit > timeout:
+                    self.rejected += 1
+                    return None
+                if delay == 0.0:
+                    self._tokens -= tokens
+                    break
+                await asyncio.sleep(delay)
+                waited += delay
+            if deficit:
+                # Con el lock tomado: los siguientes llamadores esperan detrás de la deuda
+                await asyncio.sleep(deficit)
+                waited += deficit
+        self.acquired += tokens
+        if waited:
+            self.waits += 1
+            self.wait_seconds += waited
+        return waited
+
+    def throttle(self, delay: float) -> None:
+        """
+        Registra un 429 y pausa a todos los llamadores durante `delay` segundos (Retry-After).
+        """
+        self.throttled += 1
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + delay)
+        # Tras la pausa se arranca con el cubo vacío para no reproducir la ráfaga que provocó el 429
+        self._tokens = 0.0
+        self._updated = max(self._updated, self._paused_until)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve la configuración y las métricas del limitador.
+        """
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "throttled_429": self.throttled,
+            "rejected": self.rejected,
+        }
+
+
+# Registro de limitadores compartidos: "tenant/entorno" -> TokenBucket
+_rate_limiters: Dict[str, TokenBucket] = {}
+
+
+def rate_limiter_for(tenant_id: str, environment: str, rate: float, burst: int) -> Optional[TokenBucket]:
+    """
+    Devuelve el limitador compartido de un tenant/entorno, creándolo si no existe.
+    Con `rate <= 0` no se limita la tasa y se retorna None.
+    """
+    if rate <= 0:
+        return None
+    key = f"{tenant_id}/{environment}"
+    limiter = _rate_limiters.get(key)
+    if limiter is None:
+        limiter = _rate_limiters[key] = TokenBucket(rate, burst)
+    return limiter
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker con estados cerrado, abierto y semiabierto.
+      - Cerrado: las llamadas pasan; `failure_threshold` fallos consecutivos lo abren.
+      - Abierto: las llamadas se rechazan sin tocar la red durante `recovery_timeout` segundos.
+      - Semiabierto: se permiten hasta `half_open_max_calls` sondas; un éxito lo cierra y
+        un fallo lo vuelve a abrir.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        # Métricas
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Indica si se puede realizar una llamada. En semiabierto reserva una sonda.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self) -> None:
+        """
+        Libera una sonda reservada cuya llamada no llegó a completarse (p.ej. cancelación).
+        """
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        """
+        Registra una respuesta del servidor: cierra el circuito y reinicia los fallos.
+        """
+        self._failures = 0
+        self._probes = 0
+        self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        """
+        Registra un fallo (5xx o error de transporte) y abre el circuito si procede.
+        """
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.opened += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve el estado y las métricas del circuito.
+        """
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limitador de concurrencia AIMD (incremento aditivo, decremento multiplicativo).
+      - Cada respuesta sana con latencia dentro de `latency_tolerance` veces la latencia base
+        suma `1/limit` al límite (≈ +1 por ventana completa de peticiones). La latencia base
+        se lleva por tipo de petición (`key`), porque una lista o un `$batch` tardan de forma
+        natural varias veces más que la lectura de una entidad.
+      - Un 429, 5xx, error de red o una latencia excesiva multiplica el límite por `backoff`
+        (como mucho una vez por latencia base, para no encadenar recortes).
+      - Los llamadores por encima del límite esperan en cola FIFO hasta `max_wait` segundos.
+    """
+    def __init__(self, initial: int = 10, min_limit: int = 1, max_limit: int = 50,
+                 max_wait: float = 30.0, latency_tolerance: float = 2.0, backoff: float = 0.7):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_wait = max_wait
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Latencia base por tipo de petición (p.ej. 'GET customers', 'GET customers(id)')
+        self._baselines: Dict[str, float] = {}
+        self._last_decrease = 0.0
+        # Métricas
+        self.rejected = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Reserva un hueco de concurrencia. Retorna False si la espera supera `max_wait`
+        (o `timeout`, si es menor).
+        """
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+            await asyncio.wait_for(fut, wait)
+            return True
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # El hueco se concedió justo al vencer la espera
+                return True
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # El hueco se concedió antes de la cancelación: se devuelve al siguiente en cola
+                self._in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+    def release(self, latency: float, overloaded: Optional[bool], key: str = "") -> None:
+        """
+        Libera el hueco y ajusta el límite según el resultado de la llamada.
+        Parámetros:
+            latency (float): Duración de la llamada (segundos)
+            overloaded (bool): True ante 429, 5xx o error de transporte; None si la
+                llamada no terminó (cancelada o sin plazo) y no debe influir en el límite
+            key (str): Tipo de petición cuya latencia base se usa como referencia
+        """
+        self._in_flight -= 1
+        if overloaded is None:
+            self._wake()
+            return
+        now = time.monotonic()
+        baseline = self._baselines.get(key)
+        slow = baseline is not None and latency > baseline * self.latency_tolerance
+        if overloaded or slow:
+            if now - self._last_decrease >= (baseline or 0.0):
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+        else:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+        if not overloaded:
+            # Latencia base: mínimo observado que deriva lentamente hacia arriba
+            if baseline is None or latency < baseline:
+                self._baselines[key] = latency
+            else:
+                self._baselines[key] = baseline + (latency - baseline) * 0.01
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._in_flight += 1
+                fut.set_result(True)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve el límite actual y las métricas del limitador.
+        """
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "baseline_latency": {k: round(v, 4) for k, v in self._baselines.items()},
+            "decreases": self.decreases,
+            "rejected": self.rejected,
+        }
+
+
+class HedgingPolicy:
+    """
+    Política de peticiones de cobertura (hedged requests) para lecturas idempotentes.
+    Si la petición original no responde en el percentil `percentile` de las latencias
+    recientes, se lanza una segunda idéntica y se usa la primera que termine.
+    El presupuesto limita las coberturas a `budget_ratio` de las peticiones (p.ej. 5%).
+    """
+    def __init__(self, percentile: float = 95.0, min_delay: float = 0.05,
+                 budget_ratio: float = 0.05, min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+        # El crédito inicial permite alguna cobertura antes de acumular peticiones
+        self._credits = 1.0
+        # Métricas
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> Optional[float]:
+        """
+        Retardo tras el que conviene lanzar la cobertura, o None si aún no hay muestras suficientes.
+        """
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[idx])
+
+    def record_request(self) -> None:
+        """
+        Contabiliza una petición original y acumula presupuesto de cobertura.
+        """
+        self.requests += 1
+        self._credits = min(10.0, self._credits + self.budget_ratio)
+
+    def record_latency(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def try_hedge(self) -> bool:
+        """
+        Consume presupuesto para una cobertura. Retorna False si se ha agotado.
+        """
+        if self._credits < 1.0:
+            return False
+        self._credits -= 1.0
+        self.hedges += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve el retardo actual y las métricas de cobertura.
+        """
+        d = self.delay()
+        return {
+            "delay": round(d, 4) if d is not None else None,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+# Métodos HTTP idempotentes: se pueden repetir sin riesgo de duplicar efectos
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Errores de transporte en los que la petición no llegó a enviarse al servidor
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos compartido por todo el proceso.
+    Cada petición original aporta `ratio` créditos y cada reintento consume uno; además se
+    reponen `min_per_sec` créditos por segundo para que el tráfico bajo pueda reintentar.
+    Durante una caída los reintentos quedan acotados a ~`ratio` de la carga original.
+    """
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 1.0, cap: float = 20.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.cap = cap
+        self._credits = cap
+        self._updated = time.monotonic()
+        # Métricas
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._credits = min(self.cap, self._credits + (now - self._updated) * self.min_per_sec)
+        self._updated = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self._credits = min(self.cap, self._credits + self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Consume un crédito para un reintento. Retorna False si el presupuesto está agotado.
+        """
+        self._refill()
+        if self._credits < 1.0:
+            self.exhausted += 1
+            return False
+        self._credits -= 1.0
+        self.retries += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "credits": round(self._credits, 2),
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+        }
+
+
+class RetryPolicy:
+    """
+    Política de reintentos para las llamadas a Business Central.
+      - Backoff exponencial con jitter completo: espera aleatoria en [0, min(max_delay, base·2^n)].
+      - Peticiones idempotentes: se reintentan ante 401, 429, 5xx y errores de transporte.
+      - Peticiones no idempotentes (POST/PATCH): solo cuando BC no llegó a procesarlas
+        (401, 429 o error de conexión antes de enviar), salvo que el llamador aporte una
+        función de recuperación que compruebe si la escritura ya se aplicó.
+      - Presupuesto opcional compartido (`RetryBudget`).
+    Se puede sustituir por otra implementación asignando `bc_client.retry_policy`.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 8.0,
+                 budget: Optional[RetryBudget] = None, rng: Callable[[], float] = random.random):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._rng = rng
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Espera antes del reintento número `attempt + 1` (full jitter).
+        """
+        return self._rng() * min(self.max_delay, self.base_delay * (2 ** attempt))
+
+    def is_retryable(self, idempotent: bool, status: Optional[int] = None,
+                     error: Optional[BaseException] = None) -> bool:
+        """
+        Indica si el resultado de un intento admite reintento según el tipo de petición.
+        """
+        if error is not None:
+            return idempotent or isinstance(error, _NOT_SENT_ERRORS)
+        if status in (401, 429):
+            return True
+        if status is not None and status >= 500:
+            return idempotent
+        return False
+
+    @staticmethod
+    def outcome_unknown(status: Optional[int] = None, error: Optional[BaseException] = None) -> bool:
+        """
+        Indica si un intento fallido pudo llegar a aplicarse en BC (5xx, timeout de lectura,
+        conexión cortada): antes de repetir una escritura hay que comprobar si ya existe.
+        """
+        if error is not None:
+            return not isinstance(error, _NOT_SENT_ERRORS)
+        return status is not None and status >= 500
+
+    def record_request(self) -> None:
+        if self.budget is not None:
+            self.budget.record_request()
+
+    def try_spend(self) -> bool:
+        return self.budget is None or self.budget.try_spend()
@@ -0,0 +1,288 @@
+"""
+shared_state.py
+
+Estado compartido entre los workers de uvicorn de una misma máquina.
+
+Características principales:
+  - Backend enchufable (`BC_SHARED_STATE`) tras la interfaz `SharedStore`:
+      * `memory` (por defecto, `MemoryStore`): cada proceso guarda su propio estado.
+      * `sqlite`: almacén clave-valor con caducidad en un fichero SQLite local
+        (`BC_SHARED_STATE_PATH`, por defecto en el directorio temporal del sistema) en modo
+        WAL y con lecturas mapeadas en memoria (`mmap_size`), de modo que varios procesos
+        leen sin bloquearse y una lectura cuesta microsegundos.
+  - Lo usan el gestor de tokens (un token renovado por un worker sirve a todos) y las cachés
+    de respuestas (una entidad leída por un worker la reutilizan los demás).
+  - Contadores de generación (`incr`) para invalidar entre procesos: una escritura en un
+    worker deja obsoletas las copias en memoria de los demás.
+  - Si el fichero está ocupado más de `busy_timeout` se omite la operación (se trata como
+    fallo de caché); nunca se bloquea el event loop más de ese tiempo.
+
+Onboarding rápido:
+  1. `BC_SHARED_STATE=sqlite` y, opcionalmente, `BC_SHARED_STATE_PATH=/home/bc_state.db`.
+  2. Arranca uvicorn con varios workers: comparten tokens y lecturas cacheadas.
+  3. Consulta `shared_store.stats()` (también en `/health`).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+from config import config
+
+logger = logging.getLogger("shared_state")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key        TEXT PRIMARY KEY,
+    value      BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+# Cada cuántas escrituras se purgan las entradas caducadas
+_PURGE_EVERY = 500
+
+
+def _check_owner(st: os.stat_result, path: str) -> None:
+    if st.st_uid != os.geteuid():
+        raise PermissionError(f"{path} pertenece a otro usuario (uid {st.st_uid}); no se usará")
+
+
+def private_dir(directory: str) -> None:
+    """
+    Crea `directory` con modo 0700 si no existe y comprueba que sea privado: del usuario del
+    proceso y sin permisos de grupo ni de otros. Lanza PermissionError si no lo es.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, "geteuid"):
+        return  # Sin propietarios POSIX (Windows): solo se crea
+    st = os.stat(directory)
+    _check_owner(st, directory)
+    if st.st_mode & 0o077:
+        raise PermissionError(
+            f"{directory} es accesible por otros usuarios (modo {st.st_mode & 0o777:o}); "
+            f"restríngelo con 'chmod 700 {directory}'"
+        )
+
+
+def private_file(path: str) -> None:
+    """
+    Crea `path` con modo 0600 si no existe. Si existe y es del usuario del proceso le quita
+    los permisos de grupo y de otros; si es de otro usuario lanza PermissionError.
+    """
+    fd = os.open(path, os.O_CREAT | os.O_RDWR | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        if not hasattr(os, "geteuid"):
+            return
+        st = os.fstat(fd)
+        _check_owner(st, path)
+        if st.st_mode & 0o077:
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+class SharedStore(ABC):
+    """
+    Interfaz de un almacén clave-valor con caducidad para el estado de tokens y cachés.
+    Las claves son texto y los valores bytes; `expires_at` es un instante epoch (time.time()).
+    Las implementaciones deben poder usarse desde hilos (`asyncio.to_thread`).
+    """
+    # True si el almacén lo comparten varios procesos (y sus operaciones tocan disco)
+    cross_process = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """
+        Devuelve (valor, expires_at) si la clave existe y no ha caducado.
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, expires_at: float) -> None:
+        """
+        Guarda un valor hasta `expires_at`.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Elimina una clave.
+        """
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """
+        Incrementa de forma atómica un contador (sin caducidad) y retorna su nuevo valor.
+        """
+
+    @abstractmethod
+    def counter(self, key: str) -> int:
+        """
+        Devuelve el valor actual de un contador (0 si no existe).
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve el backend y las métricas del almacén.
+        """
+
+    def close(self) -> None:
+        """
+        Libera los recursos del almacén.
+        """
+
+
+class MemoryStore(SharedStore):
+    """
+    Almacén del propio proceso (backend `memory`): cada worker tiene el suyo.
+    """
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, value: bytes, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._writes += 1
+            if self._writes % _PURGE_EVERY == 0:
+                now = time.time()
+                self._data = {k: v for k, v in self._data.items() if v[1] > now}
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            entries = sum(1 for _, expires_at in self._data.values() if expires_at > now)
+        return {"backend": "memory", "entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteStore(SharedStore):
+    """
+    Almacén sobre un fichero SQLite local en modo WAL. Una conexión por proceso, protegida
+    por un lock para poder usarse también desde hilos (`asyncio.to_thread`).
+    """
+    cross_process = True
+
+    def __init__(self, path: str, busy_timeout: float = 0.2, mmap_size: int = 64 * 1024 * 1024):
+        self.path = path
+        # Contiene tokens de acceso: el fichero (y sus -wal/-shm, que heredan el modo) solo
+        # es legible por el usuario del proceso
+        for name in (path, path + "-wal", path + "-shm"):
+            if name == path or os.path.exists(name):
+                private_file(name)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                   timeout=busy_timeout)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _run(self, sql: str, args: Tuple = ()) -> Optional[list]:
+        """
+        Ejecuta una sentencia y retorna sus filas (o `[filas afectadas]` si no es una consulta);
+        retorna None (y cuenta el error) si el fichero está ocupado.
+        """
+        try:
+            with self._lock:
+                cur = self._db.execute(sql, args)
+                return cur.fetchall() if cur.description else [cur.rowcount]
+        except sqlite3.OperationalError as e:
+            self.errors += 1
+            logger.debug(f"Estado compartido no disponible ({e}); se omite la operación.")
+            return None
+
+    def _written(self) -> None:
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self._run("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        rows = self._run("SELECT value, expires_at FROM kv WHERE key = ? AND expires_at > ?", (key, time.time()))
+        if not rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytes(rows[0][0]), rows[0][1]
+
+    def set(self, key: str, value: bytes, expires_at: float) -> None:
+        self._run("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+        self._written()
+
+    def delete(self, key: str) -> None:
+        self._run("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        if self._run(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1",
+            (key, float("inf")),
+        ) is None:
+            return 0
+        return self.counter(key)
+
+    def counter(self, key: str) -> int:
+        rows = self._run("SELECT value FROM kv WHERE key = ?", (key,))
+        return int(rows[0][0]) if rows else 0
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._run("SELECT COUNT(*) FROM kv WHERE expires_at > ?", (time.time(),))
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": rows[0][0] if rows else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def create_store(backend: str, path: str) -> SharedStore:
+    """
+    Crea el almacén del backend indicado ('memory' = estado del propio proceso).
+    """
+    if backend == "sqlite":
+        private_dir(os.path.dirname(os.path.abspath(path)))
+        return SQLiteStore(path)
+    return MemoryStore()
+
+
+# Instancia del proceso (`MemoryStore` con el backend 'memory')
+shared_store: SharedStore = create_store(config.shared_state.backend, config.shared_state.path)
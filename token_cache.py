@@ -0,0 +1,139 @@
+"""
+token_cache.py
+
+Caché persistente en disco de tokens de Azure AD para arranques en frío rápidos.
+
+Características principales:
+  - Un worker nuevo o reiniciado reutiliza un token todavía válido en lugar de esperar a
+    Entra ID antes de atender su primera petición.
+  - Entradas por tenant/aplicación/scope: un único fichero sirve a todos los perfiles.
+  - Escritura atómica (fichero temporal + `os.replace`): nunca se lee un fichero a medias.
+  - Permisos restringidos: el fichero se crea con modo 0600 (solo el usuario del proceso) en
+    un directorio 0700; no arranca si el directorio es de otro usuario o accesible por otros.
+  - Al escribir se descartan las entradas caducadas.
+  - Con `BC_SHARED_STATE=sqlite` los tokens se guardan en el almacén compartido
+    (`StoreTokenCache`), que además persiste entre reinicios.
+
+Onboarding rápido:
+  1. Actívala con `AZURE_TOKEN_CACHE_ENABLED=true` (fichero en `AZURE_TOKEN_CACHE_PATH`; por
+     defecto en el directorio temporal del sistema, fuera del repositorio).
+  2. Ubica el fichero en un disco local persistente del servidor (p.ej. `/home` en App Service).
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import jsoncodec
+from shared_state import SharedStore, private_dir
+
+logger = logging.getLogger("token_cache")
+
+
+def cache_key(tenant_id: str, client_id: str, scope: str) -> str:
+    """
+    Clave de una entrada: tenant, aplicación y scope del token.
+    """
+    return f"{tenant_id}|{client_id}|{scope}"
+
+
+class FileTokenCache:
+    """
+    Fichero JSON clave -> {token, expires_at (epoch)}. Seguro entre hilos; entre procesos
+    gana la última escritura, lo que como mucho provoca un fetch de token adicional.
+    """
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        # Directorio 0700 del usuario del proceso: nadie más puede sustituir el fichero
+        private_dir(os.path.dirname(self.path))
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Dict[str, object]]:
+        try:
+            with open(self.path, "rb") as f:
+                data = jsoncodec.loads(f.read())
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Caché de tokens ilegible ({self.path}): {e!r}")
+            return {}
+
+    def _write(self, data: Dict[str, Dict[str, object]]) -> None:
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # mkstemp crea el fichero con modo 0600; os.replace lo publica de forma atómica
+        fd, tmp = tempfile.mkstemp(prefix=".token_cache.", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(jsoncodec.dumps(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        Devuelve (token, expires_at) si hay una entrada sin caducar para `key`.
+        """
+        with self._lock:
+            entry = self._read().get(key)
+        if not isinstance(entry, dict):
+            return None
+        token, expires_at = entry.get("token"), entry.get("expires_at")
+        if not token or not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return None
+        return token, float(expires_at)
+
+    def put(self, key: str, token: str, expires_at: float) -> None:
+        """
+        Guarda el token de `key` y descarta las entradas caducadas.
+        """
+        now = time.time()
+        with self._lock:
+            data = {
+                k: v for k, v in self._read().items()
+                if isinstance(v, dict) and isinstance(v.get("expires_at"), (int, float)) and v["expires_at"] > now
+            }
+            data[key] = {"token": token, "expires_at": expires_at}
+            self._write(data)
+
+    def delete(self, key: str, token: Optional[str] = None) -> None:
+        """
+        Elimina la entrada de `key` (solo si coincide con `token`, cuando se indica).
+        """
+        with self._lock:
+            data = self._read()
+            entry = data.get(key)
+            if entry is None or (token is not None and isinstance(entry, dict) and entry.get("token") != token):
+                return
+            del data[key]
+            self._write(data)
+
+
+class StoreTokenCache:
+    """
+    Misma interfaz que `FileTokenCache` sobre el almacén compartido entre workers.
+    """
+    def __init__(self, store: SharedStore):
+        self._store = store
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        entry = self._store.get("token|" + key)
+        return (entry[0].decode(), entry[1]) if entry is not None else None
+
+    def put(self, key: str, token: str, expires_at: float) -> None:
+        self._store.set("token|" + key, token.encode(), expires_at)
+
+    def delete(self, key: str, token: Optional[str] = None) -> None:
+        if token is not None:
+            entry = self.get(key)
+            if entry is None or entry[0] != token:
+                return
+        self._store.delete("token|" + key)
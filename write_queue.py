@@ -0,0 +1,321 @@
+"""
+write_queue.py
+
+Cola local y duradera de escrituras diferidas (write-behind) hacia Business Central.
+
+Características principales:
+  - `create_customer` en modo `background` valida el payload, lo guarda en un fichero SQLite
+    (modo WAL) y devuelve al instante un ticket, sin esperar a Business Central.
+  - Un worker en segundo plano (arrancado en `app_lifespan`) vacía la cola por lotes con
+    `bc_client.create_customers` (`$batch`) y guarda el resultado de cada ticket.
+  - `get_write_status(ticket)` consulta el estado: pending, processing, done o failed.
+  - Las escrituras de resultado incierto (lote sin respuesta, reinicio a mitad de envío) se
+    reintentan una a una con clave de idempotencia y comprobación previa de existencia.
+  - Varios workers (p.ej. de uvicorn) pueden compartir el fichero: cada lote se reserva de
+    forma atómica a nombre del worker durante `BC_WRITE_QUEUE_LEASE` s, y solo se recuperan
+    las escrituras cuya reserva caducó (su worker murió a mitad de envío).
+
+Onboarding rápido:
+  1. Activa la cola con `BC_WRITE_QUEUE_ENABLED=true` (fichero en `BC_WRITE_QUEUE_PATH`; por
+     defecto en el directorio temporal, en producción usa un disco persistente como `/home/data`).
+  2. Llama a `create_customer(..., background=True)` y guarda el ticket devuelto.
+  3. Consulta el resultado con `get_write_status(ticket)`.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from client import OutcomeUnknownError
+from config import config
+from shared_state import private_dir, private_file
+import jsoncodec
+
+logger = logging.getLogger("write_queue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    ticket     TEXT PRIMARY KEY,
+    kind       TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    company    TEXT,
+    profile    TEXT,
+    status     TEXT NOT NULL,
+    owner      TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    result     TEXT,
+    error      TEXT,
+    not_before REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS writes_status ON writes (status, not_before);
+"""
+
+PENDING, PROCESSING, DONE, FAILED = "pending", "processing", "done", "failed"
+
+
+def _dumps(obj: Any) -> str:
+    return jsoncodec.dumps(obj).decode()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class WriteQueue:
+    """
+    Cola SQLite de escrituras pendientes con worker asíncrono de vaciado por lotes.
+    Las operaciones sobre el fichero se ejecutan en un hilo para no bloquear el event loop
+    del worker; `enqueue()` es síncrono porque solo inserta una fila (milisegundos).
+    """
+    def __init__(self, path: str, batch_size: int = 20, poll_interval: float = 1.0, max_attempts: int = 5,
+                 lease: float = 300.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        # Identifica las reservas de este proceso frente a los demás workers del fichero
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Los payloads contienen datos de clientes: directorio 0700 y fichero 0600 del usuario
+        private_dir(os.path.dirname(os.path.abspath(path)))
+        private_file(path)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # FULL: un ticket devuelto al cliente sobrevive también a un corte de luz (con NORMAL,
+        # en WAL, las últimas transacciones confirmadas pueden perderse)
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(_SCHEMA)
+        # Ficheros creados antes de las columnas `company`/`profile` (escrituras por defecto) y
+        # `owner`/`lease_until` (sin reserva: lo que quedó en 'processing' se recupera)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(writes)")}
+        for column, kind in (("company", "TEXT"), ("profile", "TEXT"), ("owner", "TEXT"),
+                             ("lease_until", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE writes ADD COLUMN {column} {kind}")
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _execute(self, sql: str, args: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], ticket: Optional[str] = None,
+                company: Optional[str] = None, profile: Optional[str] = None) -> str:
+        """
+        Guarda una escritura en la cola y retorna su ticket. Si se indica un ticket (p.ej. la
+        clave de idempotencia) y ya existe, no se encola de nuevo. `company` es el id de la
+        compañía destino y `profile` el perfil de conexión (None = los del cliente por defecto).
+        """
+        ticket = ticket or uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO writes (ticket, kind, payload, company, profile, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (ticket, kind, _dumps(payload), company, profile, PENDING, now, now),
+        )
+        if self._wake is not None:
+            self._wake.set()
+        return ticket
+
+    def status(self, ticket: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve el estado de un ticket o None si no existe.
+        """
+        rows = self._execute(
+            "SELECT status, attempts, result, error, created_at, updated_at FROM writes WHERE ticket = ?",
+            (ticket,),
+        )
+        if not rows:
+            return None
+        status, attempts, result, error, created_at, updated_at = rows[0]
+        return {
+            "ticket": ticket,
+            "status": status,
+            "attempts": attempts,
+            "result": jsoncodec.loads(result) if result else None,
+            "error": error,
+            "created_at": _iso(created_at),
+            "updated_at": _iso(updated_at),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Devuelve el número de escrituras por estado.
+        """
+        return {s: n for s, n in self._execute("SELECT status, COUNT(*) FROM writes GROUP BY status")}
+
+    async def start(self, client) -> None:
+        """
+        Arranca el worker de vaciado (llamar desde `app_lifespan`).
+        """
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(client))
+
+    async def stop(self) -> None:
+        """
+        Detiene el worker. Las escrituras pendientes se envían en el siguiente arranque.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wake = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    async def _run(self, client) -> None:
+        while True:
+            try:
+                batch = await asyncio.to_thread(self._claim)
+                if batch:
+                    # Un lote `$batch` va siempre contra un solo perfil y compañía
+                    groups: Dict[Tuple[Optional[str], Optional[str]], List[Tuple[str, Dict[str, Any], int]]] = {}
+                    for ticket, payload, attempts, company, profile in batch:
+                        groups.setdefault((profile, company), []).append((ticket, payload, attempts))
+                    for (profile, company), rows in groups.items():
+                        try:
+                            await asyncio.to_thread(self._renew, [ticket for ticket, _, _ in rows])
+                            await self._flush(await client.select(profile, company), rows)
+                        except Exception as e:
+                            # Las del grupo que no llegaron a registrarse vuelven a la cola
+                            logger.error(f"Error enviando escrituras ({profile or 'default'}/{company or 'default'}): {e!r}")
+                            for ticket, _, _ in rows:
+                                await asyncio.to_thread(self._finish, ticket, False, None, repr(e), True)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error vaciando la cola de escrituras: {e!r}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim(self) -> List[Tuple[str, Dict[str, Any], int, Optional[str], Optional[str]]]:
+        """
+        Reserva para este worker el siguiente lote de escrituras pendientes, más las que otro
+        worker dejó en 'processing' con la reserva caducada, y lo devuelve.
+        La consulta y la reserva van en una transacción `BEGIN IMMEDIATE`: dos procesos nunca
+        reservan la misma escritura.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT ticket, payload, attempts, company, profile FROM writes "
+                    "WHERE (status = ? AND not_before <= ?) OR (status = ? AND lease_until <= ?) "
+                    "ORDER BY created_at LIMIT ?",
+                    (PENDING, now, PROCESSING, now, self.batch_size),
+                ).fetchall()
+                if rows:
+                    self._db.executemany(
+                        "UPDATE writes SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated_at = ? WHERE ticket = ?",
+                        [(PROCESSING, self.owner, now + self.lease, now, row[0]) for row in rows],
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(t, jsoncodec.loads(p), n + 1, c, pr) for t, p, n, c, pr in rows]
+
+    def _renew(self, tickets: List[str]) -> None:
+        """
+        Prolonga la reserva de este worker sobre `tickets` antes de enviarlos.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE writes SET lease_until = ? WHERE ticket = ? AND status = ? AND owner = ?",
+                [(now + self.lease, ticket, PROCESSING, self.owner) for ticket in tickets],
+            )
+
+    def _finish(self, ticket: str, ok: bool, result: Any = None, error: Optional[str] = None,
+                retry: bool = False) -> None:
+        """
+        Registra el resultado de una escritura (o la devuelve a la cola si `retry`).
+        Solo se modifican escrituras que siguen reservadas por este worker.
+        """
+        now = time.time()
+        if retry:
+            attempts = self._execute("SELECT attempts FROM writes WHERE ticket = ?", (ticket,))
+            if attempts and attempts[0][0] < self.max_attempts:
+                # Espera creciente antes del siguiente intento (1, 2, 4... hasta 60 s)
+                not_before = now + min(60.0, 2.0 ** attempts[0][0])
+                self._execute(
+                    "UPDATE writes SET status = ?, owner = NULL, error = ?, not_before = ?, updated_at = ? "
+                    "WHERE ticket = ? AND status = ? AND owner = ?",
+                    (PENDING, error, not_before, now, ticket, PROCESSING, self.owner),
+                )
+                return
+        self._execute(
+            "UPDATE writes SET status = ?, owner = NULL, result = ?, error = ?, updated_at = ? "
+            "WHERE ticket = ? AND status = ? AND owner = ?",
+            (DONE if ok else FAILED, _dumps(result) if result is not None else None, error, now,
+             ticket, PROCESSING, self.owner),
+        )
+
+    async def _flush(self, client, batch: List[Tuple[str, Dict[str, Any], int]]) -> None:
+        """
+        Envía un lote con `create_customers` y guarda el resultado de cada ticket.
+        Las escrituras que ya se intentaron antes van por la vía individual con comprobación
+        de existencia, porque un intento anterior pudo haberse aplicado.
+        """
+        for ticket, payload, attempts in batch:
+            if attempts > 1:
+                await self._recover(client, ticket, payload)
+        batch = [(ticket, payload) for ticket, payload, attempts in batch if attempts == 1]
+        if not batch:
+            return
+        res = await client.create_customers([payload for _, payload in batch])
+        for (ticket, payload), item in zip(batch, res["results"]):
+            if item.get("ok"):
+                await asyncio.to_thread(self._finish, ticket, True, item.get("customer"))
+            elif item.get("status") is None:
+                # Resultado incierto: reintento individual con idempotencia y comprobación previa
+                await self._recover(client, ticket, payload)
+            elif item["status"] == 429 or item["status"] >= 500:
+                await asyncio.to_thread(self._finish, ticket, False, None, item.get("error"), True)
+            else:
+                await asyncio.to_thread(self._finish, ticket, False, None, item.get("error"))
+        logger.info(f"Cola de escrituras: lote de {len(batch)} enviado ({res['created']} creados)")
+
+    async def _recover(self, client, ticket: str, payload: Dict[str, Any]) -> None:
+        """
+        Completa una escritura de resultado incierto sin duplicarla. Si no se puede comprobar
+        si ya existe, no se crea: vuelve a la cola para comprobarlo más tarde.
+        """
+        try:
+            existing = await client._find_customer(payload)
+            if existing is None:
+                existing = await client.create_customer(payload, idempotency_key=ticket)
+        except OutcomeUnknownError as e:
+            await asyncio.to_thread(self._finish, ticket, False, None, str(e), True)
+            return
+        if existing is not None:
+            await asyncio.to_thread(self._finish, ticket, True, existing)
+        else:
+            await asyncio.to_thread(self._finish, ticket, False, None, "No se pudo crear el cliente en Business Central", True)
+
+
+# Instancia compartida (None si la cola está desactivada)
+write_queue: Optional[WriteQueue] = WriteQueue(
+    config.write_queue.path, config.write_queue.batch_size, config.write_queue.poll_interval,
+    config.write_queue.max_attempts, config.write_queue.lease
+) if config.write_queue.enabled else None